@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import (Profile, FriendRequest, Post, PostImage, PostVideo, 
-                    ChatRoom, Message, BlockedPost, ContentModerationStatus)
+                    ChatRoom, Message, BlockedPost, ContentModerationStatus, ModerationJob)
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
@@ -156,3 +156,9 @@ class ContentModerationStatusAdmin(admin.ModelAdmin):
         return format_html(html)
     
     content_data_display.short_description = "Moderation Data"
+
+@admin.register(ModerationJob)
+class ModerationJobAdmin(admin.ModelAdmin):
+    list_display = ('content_type', 'content_id', 'status', 'attempts', 'run_after', 'locked_by')
+    list_filter = ('status', 'content_type')
+    search_fields = ('content_id', 'last_error')
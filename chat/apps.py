@@ -16,10 +16,17 @@ class ChatConfig(AppConfig):
         from django.db.models.signals import post_migrate
         from django.dispatch import receiver
         
+        # Register the unread-count cache invalidation receivers
+        from . import read_state  # noqa: F401
+        
         @receiver(post_migrate)
         def run_after_migrations(sender, **kwargs):
             if sender.name == self.name:  # Only run for this app
                 self.apply_schema_fixes()
+                
+                # Cache the resulting schema so views never have to probe it per request
+                from .schema import refresh_schema_capabilities
+                refresh_schema_capabilities(kwargs.get('using', 'default'))
         
     def apply_schema_fixes(self):
         """Add missing columns to the database schema if they don't exist"""
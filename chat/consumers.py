@@ -1,7 +1,10 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+from .message_buffer import get_message_buffer
 from .models import ChatRoom, Message, Profile
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -12,7 +15,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         print(f"WebSocket connect attempt: user={self.user}, room={self.room_id}, group={self.room_group_name}")
         
-        # Join room group without checking access (for simplicity)
+        # Resolve the sender and room once; every message on this socket reuses them
+        self.profile, self.room = await self.get_room_access()
+        # Counts chat_message frames sent on this socket; a gap tells the client it missed some
+        self.sequence = 0
+        if self.room is None:
+            print(f"WebSocket rejected: user {self.user} is not a participant of room {self.room_id}")
+            await self.close()
+            return
+        
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -21,26 +32,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
         print(f"WebSocket connection accepted for user {self.user} in room {self.room_id}")
         
-        # Send connection status message to the group
-        if self.user.is_authenticated:
-            username = self.user.username
-        else:
-            username = "Anonymous"
-            
         # Notify everyone that a new user joined
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'connection_message',
-                'message': f"{username} joined the chat",
+                'message': f"{self.user.username} joined the chat",
                 'username': 'System',
-                'timestamp': self.get_time_string()
+                'timestamp': timezone.now().isoformat()
             }
         )
     
     async def disconnect(self, close_code):
         # Leave room group
         print(f"WebSocket disconnected for user {self.user} in room {self.room_id} with code {close_code}")
+        if getattr(settings, 'CHAT_WRITE_BUFFER_ENABLED', False):
+            # Do not let this socket's last messages wait for the next batch
+            await get_message_buffer().flush()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -56,24 +64,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message_type = data.get('type', 'chat_message')
             
             if message_type == 'chat_message':
-                # Handle regular chat messages
+                # Only the text comes from the client; sender, id and time are set by
+                # the server and broadcast through message_saved once the row is stored
                 message = data['message']
-                username = data['username']
-                
-                print(f"Broadcasting message to group: {self.room_group_name}")
-                # Send message to room group immediately without waiting for database save
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'message': message,
-                        'username': username,
-                        'timestamp': self.get_time_string()
-                    }
-                )
                 
-                # Save message to database in the background
-                if self.user.is_authenticated:
+                if getattr(settings, 'CHAT_WRITE_BUFFER_ENABLED', False):
+                    get_message_buffer().add(self.room, self.profile, message)
+                else:
                     await self.save_message(message)
             
             elif message_type == 'webrtc_signal':
@@ -102,28 +99,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
             import traceback
             traceback.print_exc()
     
-    def get_time_string(self):
-        from datetime import datetime
-        now = datetime.now()
-        hour = now.hour % 12 or 12
-        minute = now.minute
-        ampm = 'PM' if now.hour >= 12 else 'AM'
-        return f"{hour}:{minute:02d} {ampm}"
-    
-    # Receive message from room group
-    async def chat_message(self, event):
-        message = event['message']
-        username = event['username']
-        timestamp = event.get('timestamp', '')
-        
-        print(f"Sending chat message to WebSocket for user {self.user}: {message}")
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'username': username,
-            'timestamp': timestamp
-        }))
-    
     # Handle connection messages
     async def connection_message(self, event):
         message = event['message']
@@ -164,17 +139,52 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'call_id': event.get('call_id'),
             'signals': event.get('signals', [])
         }))
-    
+
+    # Every stored message of the room, whichever process or view saved it
+    async def message_saved(self, event):
+        payload = event['message']
+        self.sequence += 1
+        # Compact server-built envelope: clients dedupe and order by id and
+        # reconcile with get_messages instead of reloading the room
+        await self.send(text_data=json.dumps({
+            'type': 'chat_message',
+            'id': payload['id'],
+            'room_id': event['room_id'],
+            'sender_id': payload['sender_id'],
+            'username': payload['sender'],
+            'message': payload['content'],
+            'timestamp': payload['sent_at'],
+            'seq': self.sequence
+        }, separators=(',', ':')))
+
+    @database_sync_to_async
+    def get_room_access(self):
+        """
+        Return (profile, room) when the connecting user participates in the room,
+        otherwise (None, None). Membership is checked once per connection, in
+        three queries: the profile, the room and its participants. The room's
+        participants stay prefetched, so the unread-count invalidation of every
+        message saved on this socket needs no query; members who join later
+        only see their cached counts refresh on the cache timeout.
+        """
+        if not self.user.is_authenticated:
+            return None, None
+        profile = Profile.objects.select_related('user').filter(user=self.user).first()
+        if profile is None:
+            return None, None
+        room = ChatRoom.objects.filter(id=self.room_id, participants=profile).prefetch_related('participants').first()
+        if room is None:
+            return None, None
+        return profile, room
+
     @database_sync_to_async
     def save_message(self, message):
         try:
             print(f"Saving message to database for user {self.user}: {message}")
-            profile = Profile.objects.get(user=self.user)
-            chat_room = ChatRoom.objects.get(id=self.room_id)
-            
+            # The profile and room resolved at connect time make this a single INSERT
             message_obj = Message.objects.create(
-                room=chat_room,
-                sender=profile,
+                room=self.room,
+                sender=self.profile,
                 content=message
             )
             print(f"Message saved successfully with ID: {message_obj.id}")
@@ -1,16 +1,119 @@
 import os
-import requests
 import logging
 from django.conf import settings
 from PIL import Image
 import io
 import base64
 import numpy as np
-import tempfile
+import threading
+import time
 import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+from .moderation_cache import lookup_verdicts, lookup_video_verdict, store_verdict
+from .moderation_client import get_api_client
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
 logger = logging.getLogger(__name__)
 
+# Process-wide registry of loaded moderation models, so every worker process
+# pays the load cost once and each image only costs inference
+_loaded_models = {}
+_model_stats = {}
+_registry_lock = threading.Lock()
+
+def _load_nudenet_classifier():
+    from nudenet import NudeClassifier
+    # The first run downloads the model weights
+    return NudeClassifier()
+
+def _load_tensorflow_model():
+    import tensorflow as tf
+    import tensorflow_hub as hub
+    # Use a model that can detect general objects, then we'll post-process
+    # the results to identify potential violence/gore
+    model_url = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/classification/4"
+    return tf.keras.Sequential([
+        hub.KerasLayer(model_url)
+    ])
+
+def _load_imagenet_labels():
+    labels_path = os.path.join(os.path.dirname(__file__), 'imagenet_labels.txt')
+    if not os.path.exists(labels_path):
+        # Download labels if they don't exist
+        url = "https://storage.googleapis.com/download.tensorflow.org/data/ImageNetLabels.txt"
+        r = get_api_client('downloads').request('GET', url)
+        r.raise_for_status()
+        with open(labels_path, 'wb') as f:
+            f.write(r.content)
+    
+    with open(labels_path, 'r') as f:
+        return [line.strip() for line in f.readlines()]
+
+def _load_google_vision_client():
+    from google.cloud import vision
+    # The client holds a gRPC channel, so one per process is reused for every call
+    return vision.ImageAnnotatorClient()
+
+MODEL_LOADERS = {
+    'nudenet': _load_nudenet_classifier,
+    'tensorflow': _load_tensorflow_model,
+    'imagenet_labels': _load_imagenet_labels,
+    'google_vision': _load_google_vision_client,
+}
+
+# Models each moderation service needs
+SERVICE_MODELS = {
+    'nudenet': ['nudenet'],
+    'tensorflow': ['tensorflow', 'imagenet_labels'],
+    'google_vision': ['google_vision'],
+}
+
+def _max_rss_kb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def get_moderation_model(name):
+    """Return the named model, loading it on first use in this process"""
+    model = _loaded_models.get(name)
+    if model is not None:
+        return model
+    
+    with _registry_lock:
+        if name not in _loaded_models:
+            rss_before = _max_rss_kb()
+            started = time.monotonic()
+            _loaded_models[name] = MODEL_LOADERS[name]()
+            rss_after = _max_rss_kb()
+            _model_stats[name] = {
+                'load_seconds': round(time.monotonic() - started, 3),
+                'rss_increase_kb': rss_after - rss_before if rss_before is not None else None,
+                'loaded_at': time.time(),
+                'pid': os.getpid(),
+            }
+            logger.info(f"Loaded moderation model {name} in {_model_stats[name]['load_seconds']}s")
+        return _loaded_models[name]
+
+def warm_moderation_models(service=None):
+    """Load the models of the configured moderation service ahead of the first image"""
+    service = service or getattr(settings, 'CONTENT_MODERATION_SERVICE', 'nudenet')
+    for name in SERVICE_MODELS.get(service, []):
+        try:
+            get_moderation_model(name)
+        except Exception as e:
+            logger.error(f"Could not warm moderation model {name}: {str(e)}")
+    return get_moderation_model_stats()
+
+def get_moderation_model_stats():
+    """Load time and memory growth of every model loaded in this process"""
+    return {name: dict(stats) for name, stats in _model_stats.items()}
+
 # Option 1: Using Google Cloud Vision API for content moderation (paid)
 def moderate_image_with_google_vision(image_file):
     """
@@ -21,7 +124,7 @@ def moderate_image_with_google_vision(image_file):
         # You would need to set up GCP credentials in your environment
         from google.cloud import vision
         
-        client = vision.ImageAnnotatorClient()
+        client = get_moderation_model('google_vision')
         
         if hasattr(image_file, 'read'):
             image_content = image_file.read()
@@ -32,7 +135,8 @@ def moderate_image_with_google_vision(image_file):
         image = vision.Image(content=image_content)
         
         # Performs safe search detection on the image
-        response = client.safe_search_detection(image=image)
+        api = get_api_client('google_vision')
+        response = api.call(lambda: client.safe_search_detection(image=image, timeout=api.timeout[1]))
         safe_search = response.safe_search_annotation
         
         # Check for adult, violence, or medical content
@@ -87,27 +191,21 @@ def moderate_image_with_sightengine(image_file):
             logger.error("Sightengine API credentials not configured")
             return False, 0, {"error": "API credentials not configured"}
         
-        # Prepare the image
+        # Send the bytes so no file handle is left open
         if hasattr(image_file, 'read'):
-            # File object - use requests multipart upload
-            files = {'media': image_file}
-            data = {
-                'api_user': api_user,
-                'api_secret': api_secret,
-                'models': 'nudity,gore,offensive'
-            }
-            r = requests.post('https://api.sightengine.com/1.0/check.json', 
-                             files=files, data=data)
+            media = image_file.read()
+            image_file.seek(0)
         else:
-            # Path to image file
-            files = {'media': open(image_file, 'rb')}
-            data = {
-                'api_user': api_user,
-                'api_secret': api_secret,
-                'models': 'nudity,gore,offensive'
-            }
-            r = requests.post('https://api.sightengine.com/1.0/check.json', 
-                             files=files, data=data)
+            with open(image_file, 'rb') as f:
+                media = f.read()
+        
+        data = {
+            'api_user': api_user,
+            'api_secret': api_secret,
+            'models': 'nudity,gore,offensive'
+        }
+        client = get_api_client('sightengine', getattr(settings, 'SIGHTENGINE_API_URL', 'https://api.sightengine.com/1.0'))
+        r = client.request('POST', 'check.json', files={'media': ('media', media)}, data=data)
         
         output = r.json()
         
@@ -145,49 +243,80 @@ def moderate_image_with_nudenet(image_file):
     Check if an image contains nudity using the NudeNet library.
     Returns a tuple (is_safe, confidence, categories)
     """
+    return moderate_images_with_nudenet([image_file])[0]
+
+def moderate_images_with_nudenet(image_files):
+    """
+    Classify several images with a single NudeNet call.
+    Returns a list of (is_safe, confidence, categories) tuples in input order.
+    """
     try:
-        from nudenet import NudeClassifier
-        
-        # Initialize the classifier (first run downloads the model)
-        classifier = NudeClassifier()
-        
-        # Handle different input types
-        if hasattr(image_file, 'read'):
-            # If it's a file-like object (from upload), save to temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp:
-                temp.write(image_file.read())
-                image_path = temp.name
-                # Reset file pointer for other functions
-                image_file.seek(0)
-        else:
-            # If it's a file path
-            image_path = image_file
+        classifier = get_moderation_model('nudenet')
         
-        # Classify the image
-        result = classifier.classify(image_path)
+        # Decode everything to BGR arrays; NudeNet classifies arrays in memory
+        # and keys their results by position instead of by path
+        images = [_image_array(image_file) for image_file in image_files]
+        loaded = [index for index, img in enumerate(images) if img is not None]
+        results = [(False, 0, {"error": "Unable to process image"}) for _ in image_files]
+        if not loaded:
+            return results
         
-        # Clean up temp file if created
-        if hasattr(image_file, 'read') and os.path.exists(image_path):
-            os.unlink(image_path)
-        
-        # Extract scores from the result
-        nudity_score = result[image_path].get('unsafe', 0)
+        result = classifier.classify([images[index] for index in loaded], batch_size=getattr(settings, 'MODERATION_BATCH_SIZE', 8))
         
         # Set threshold for safety
         threshold = float(getattr(settings, 'MODERATION_THRESHOLD_NUDITY', 0.6))
-        is_safe = nudity_score < threshold
         
-        categories = {
-            "nudity": nudity_score,
-            "safe": 1 - nudity_score
-        }
-        
-        return is_safe, nudity_score, categories
+        for position, index in enumerate(loaded):
+            if position not in result:
+                continue
+            
+            # Extract scores from the result
+            nudity_score = result[position].get('unsafe', 0)
+            categories = {
+                "nudity": nudity_score,
+                "safe": 1 - nudity_score
+            }
+            results[index] = (nudity_score < threshold, nudity_score, categories)
+        return results
         
     except Exception as e:
         logger.error(f"Error in NudeNet moderation: {str(e)}")
         # Default to manual review if processing fails
-        return False, 0, {"error": str(e)}
+        return [(False, 0, {"error": str(e)}) for _ in image_files]
+
+def _image_array(image_file):
+    """Decode an upload or path to a BGR array; decoded frames pass through"""
+    if isinstance(image_file, np.ndarray):
+        return image_file
+    try:
+        data = _read_image_bytes(image_file)
+    except OSError:
+        return None
+    return _decode_image(data)
+
+def _read_image_bytes(image_file):
+    if hasattr(image_file, 'read'):
+        data = image_file.read()
+        # Reset file pointer for other functions
+        image_file.seek(0)
+        return data
+    with open(image_file, 'rb') as f:
+        return f.read()
+
+def _decode_image(data, flags=cv2.IMREAD_COLOR):
+    """
+    Decode image bytes to a BGR array, or None. Formats the installed OpenCV
+    build cannot read (GIF in opencv-python 4.8, for one) are decoded with
+    Pillow instead, first frame only.
+    """
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if img is not None:
+        return img
+    try:
+        with Image.open(io.BytesIO(data)) as pil_image:
+            return cv2.cvtColor(np.asarray(pil_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+    except Exception:
+        return None
 
 # Option 4: Using TensorFlow with pre-trained model (free, open-source)
 def moderate_image_with_tensorflow(image_file):
@@ -195,78 +324,79 @@ def moderate_image_with_tensorflow(image_file):
     Check if an image contains violence or graphic content using TensorFlow.
     Returns a tuple (is_safe, confidence, categories)
     """
+    return moderate_images_with_tensorflow([image_file])[0]
+
+def moderate_images_with_tensorflow(image_files):
+    """
+    Check several images for violence with one batched model.predict call.
+    Returns a list of (is_safe, confidence, categories) tuples in input order.
+    """
     try:
         import tensorflow as tf
-        import tensorflow_hub as hub
-        
-        # Load pre-trained MobileNetV2 model once
-        if not hasattr(moderate_image_with_tensorflow, 'model'):
-            # Use a model that can detect general objects, then we'll post-process
-            # the results to identify potential violence/gore
-            model_url = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/classification/4"
-            moderate_image_with_tensorflow.model = tf.keras.Sequential([
-                hub.KerasLayer(model_url)
-            ])
-            
-        # Process the image
-        img = _load_and_prepare_image(image_file)
-        if img is None:
-            return False, 0, {"error": "Unable to process image"}
-        
-        # Make prediction
-        predictions = moderate_image_with_tensorflow.model.predict(img)
-        
-        # Load ImageNet labels
-        labels_path = os.path.join(os.path.dirname(__file__), 'imagenet_labels.txt')
-        if not os.path.exists(labels_path):
-            # Download labels if they don't exist
-            url = "https://storage.googleapis.com/download.tensorflow.org/data/ImageNetLabels.txt"
-            r = requests.get(url)
-            with open(labels_path, 'wb') as f:
-                f.write(r.content)
-                
-        with open(labels_path, 'r') as f:
-            labels = [line.strip() for line in f.readlines()]
-        
-        # Get top 5 predictions
-        top_indices = predictions[0].argsort()[-5:][::-1]
-        top_predictions = {labels[i]: float(predictions[0][i]) for i in top_indices}
-        
-        # Define violence-related categories
-        violence_categories = [
-            'revolver', 'rifle', 'assault_rifle', 'weapon', 'knife', 'dagger',
-            'axe', 'guillotine', 'chainsaw', 'blood', 'wound', 'injury',
-            'coffin', 'stretcher', 'ambulance', 'military_uniform'
-        ]
-        
-        # Check for matches in violence categories
-        violence_score = 0
-        for category in violence_categories:
-            for label, score in top_predictions.items():
-                if category.lower() in label.lower():
-                    violence_score = max(violence_score, score)
         
-        # Set threshold for safety
-        threshold = float(getattr(settings, 'MODERATION_THRESHOLD_VIOLENCE', 0.6))
-        is_safe = violence_score < threshold
+        model = get_moderation_model('tensorflow')
+        labels = get_moderation_model('imagenet_labels')
         
-        categories = {
-            "violence": violence_score,
-            "top_predictions": top_predictions
-        }
+        # Process the images; ones that cannot be decoded are reported individually
+        images = [_load_and_prepare_image(image_file) for image_file in image_files]
+        results = [(False, 0, {"error": "Unable to process image"}) for _ in image_files]
+        loaded = [index for index, img in enumerate(images) if img is not None]
+        if not loaded:
+            return results
+        
+        # Make one prediction for the whole batch
+        predictions = model.predict(tf.concat([images[index] for index in loaded], axis=0))
         
-        return is_safe, violence_score, categories
+        for row, index in enumerate(loaded):
+            results[index] = _violence_verdict(predictions[row], labels)
+        return results
         
     except Exception as e:
         logger.error(f"Error in TensorFlow moderation: {str(e)}")
         # Default to manual review if processing fails
-        return False, 0, {"error": str(e)}
+        return [(False, 0, {"error": str(e)}) for _ in image_files]
+
+def _violence_verdict(prediction, labels):
+    """Turn one row of ImageNet predictions into a violence verdict"""
+    # Get top 5 predictions
+    top_indices = prediction.argsort()[-5:][::-1]
+    top_predictions = {labels[i]: float(prediction[i]) for i in top_indices}
+    
+    # Define violence-related categories
+    violence_categories = [
+        'revolver', 'rifle', 'assault_rifle', 'weapon', 'knife', 'dagger',
+        'axe', 'guillotine', 'chainsaw', 'blood', 'wound', 'injury',
+        'coffin', 'stretcher', 'ambulance', 'military_uniform'
+    ]
+    
+    # Check for matches in violence categories
+    violence_score = 0
+    for category in violence_categories:
+        for label, score in top_predictions.items():
+            if category.lower() in label.lower():
+                violence_score = max(violence_score, score)
+    
+    # Set threshold for safety
+    threshold = float(getattr(settings, 'MODERATION_THRESHOLD_VIOLENCE', 0.6))
+    is_safe = violence_score < threshold
+    
+    categories = {
+        "violence": violence_score,
+        "top_predictions": top_predictions
+    }
+    
+    return is_safe, violence_score, categories
 
 def _load_and_prepare_image(image_file):
     """Helper function to load and prepare images for TensorFlow"""
     try:
+        import tensorflow as tf
+        
         # Handle different input types
-        if hasattr(image_file, 'read'):
+        if isinstance(image_file, np.ndarray):
+            # If decoded OpenCV frame (BGR)
+            img = tf.convert_to_tensor(cv2.cvtColor(image_file, cv2.COLOR_BGR2RGB))
+        elif hasattr(image_file, 'read'):
             # If file-like object
             image_bytes = image_file.read()
             # Reset file pointer for other functions
@@ -291,8 +421,12 @@ def _load_and_prepare_image(image_file):
 def moderate_image(image_file):
     """
     Moderate an image using the configured service.
+    Media seen before (by exact or perceptual hash) is answered from the verdict cache.
     Returns a tuple (is_safe, confidence, categories)
     """
+    return moderate_images_batch([image_file])[0]
+
+def _moderate_image_uncached(image_file):
     moderation_service = getattr(settings, 'CONTENT_MODERATION_SERVICE', 'nudenet')
     
     if moderation_service == 'google_vision':
@@ -307,125 +441,332 @@ def moderate_image(image_file):
         logger.error(f"Unknown moderation service: {moderation_service}")
         return False, 0, {"error": "Unknown moderation service"}
 
+def moderate_images_batch(image_files):
+    """
+    Moderate several images (uploads, paths or decoded frames) with the configured service.
+    Each image goes through the verdict cache and the MODERATION_CASCADE pre-filters
+    first; only images they cannot settle reach the backend. NudeNet and TensorFlow
+    classify those in one call; the remote APIs take one image per request,
+    sent concurrently.
+    Returns a list of (is_safe, confidence, categories) tuples in input order.
+    """
+    image_files = list(image_files)
+    if not image_files:
+        return []
+    
+    moderation_service = getattr(settings, 'CONTENT_MODERATION_SERVICE', 'nudenet')
+    
+    # Only media the cache has not seen reaches a backend
+    verdicts, cache_keys = lookup_verdicts(moderation_service, image_files)
+    misses = [index for index, verdict in enumerate(verdicts) if verdict is None]
+    if not misses:
+        return verdicts
+    
+    # Cheap checks settle what they can before any model or paid API runs
+    decoded = {index: _image_array(image_files[index]) for index in misses}
+    uncertain = []
+    for index in misses:
+        verdict = _run_prefilters(decoded[index])
+        if verdict is None:
+            uncertain.append(index)
+        else:
+            verdicts[index] = verdict
+            store_verdict(cache_keys[index], verdict)
+    if not uncertain:
+        return verdicts
+    
+    # Local models take the already decoded arrays; remote APIs get the original upload
+    if moderation_service == 'nudenet':
+        results = moderate_images_with_nudenet([decoded[index] for index in uncertain])
+    elif moderation_service == 'tensorflow':
+        results = moderate_images_with_tensorflow([decoded[index] for index in uncertain])
+    else:
+        # Remote requests overlap up to the API client's concurrency limit
+        workers = min(len(uncertain), getattr(settings, 'MODERATION_API_MAX_CONCURRENCY', 4))
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            results = list(executor.map(
+                lambda index: _moderate_image_uncached(_as_image_file(image_files[index])),
+                uncertain
+            ))
+    
+    for index, verdict in zip(uncertain, results):
+        verdicts[index] = verdict
+        store_verdict(cache_keys[index], verdict)
+    return verdicts
+
+def _prefilter_sanity(img):
+    """Settle images that cannot be decoded or are too small to show anything"""
+    if img is None:
+        return False, 0, {"error": "Unable to process image"}
+    # Both sides must be tiny: a thin strip can still be thousands of pixels long
+    min_side = int(getattr(settings, 'MODERATION_MIN_IMAGE_SIDE', 32))
+    if max(img.shape[:2]) < min_side:
+        return True, 0, {"prefilter": "too_small"}
+    return None
+
+def _prefilter_blood(img):
+    """
+    Reject images whose blood score reaches MODERATION_CASCADE_BLOOD_REJECT_SCORE.
+    Red colour alone says little (sunsets, tomatoes, red clothes), so with the
+    default of 0 nothing is rejected here and every image goes on to the backend.
+    """
+    reject_score = float(getattr(settings, 'MODERATION_CASCADE_BLOOD_REJECT_SCORE', 0) or 0)
+    if reject_score <= 0:
+        return None
+    is_safe, blood_score, categories = detect_blood_in_image(img)
+    if 'error' in categories:
+        return None
+    if blood_score >= reject_score:
+        return False, blood_score, dict(categories, prefilter="blood")
+    return None
+
+# Pre-filter stages, run in the order listed in MODERATION_CASCADE. Each
+# returns a verdict when it is certain, or None to pass the image on.
+PREFILTERS = {
+    'sanity': _prefilter_sanity,
+    'blood': _prefilter_blood,
+}
+
+def _run_prefilters(img):
+    for stage in getattr(settings, 'MODERATION_CASCADE', ['sanity', 'blood']):
+        prefilter = PREFILTERS.get(stage)
+        if prefilter is None:
+            logger.error(f"Unknown moderation cascade stage: {stage}")
+            continue
+        if stage != 'sanity' and img is None:
+            return None
+        verdict = prefilter(img)
+        if verdict is not None:
+            return verdict
+    return None
+
+def _as_image_file(image_file):
+    """Encode a decoded frame as an in-memory JPEG for services that upload files"""
+    if isinstance(image_file, np.ndarray):
+        success, encoded = cv2.imencode('.jpg', image_file)
+        return io.BytesIO(encoded.tobytes())
+    return image_file
+
 # Video moderation can be implemented by sampling frames
 def moderate_video(video_file):
     """
     Moderate a video by sampling frames and checking them.
+    Frames are decoded in one forward pass and kept in memory. The whole
+    video's verdict is cached under the SHA-256 of its bytes.
     Returns a tuple (is_safe, confidence, categories)
     """
+    source = _video_source(video_file)
+    moderation_service = getattr(settings, 'CONTENT_MODERATION_SERVICE', 'nudenet')
+    verdict, cache_key = lookup_video_verdict(moderation_service, source)
+    if verdict is None:
+        verdict = _moderate_video_frames(source)
+        store_verdict(cache_key, verdict)
+    return verdict
+
+def _moderate_video_frames(source):
     try:
-        import cv2
-        import tempfile
+        max_frames = int(getattr(settings, 'MODERATION_VIDEO_MAX_FRAMES', 10))
+        
+        frames = None
+        if getattr(settings, 'MODERATION_VIDEO_KEYFRAMES_ONLY', False):
+            frames = _sample_keyframes(source, max_frames)
+        if frames is None:
+            frames = _sample_frames(source, max_frames)
+        if not frames:
+            return False, 0, {"error": "Unable to decode video frames"}
+        
+        # Moderate all sampled frames in one batch
+        results = moderate_images_batch(frames)
+        
+        # If any frame is not safe, the whole video is not safe
+        is_video_safe = all(result[0] for result in results)
+        
+        # Get the highest confidence score from unsafe frames
+        if not is_video_safe:
+            unsafe_results = [result for result in results if not result[0]]
+            highest_confidence = max(result[1] for result in unsafe_results) if unsafe_results else 0
+        else:
+            highest_confidence = 0
+        
+        # Combine all categories
+        combined_categories = {}
+        for _, _, categories in results:
+            for category, score in categories.items():
+                if category in combined_categories:
+                    combined_categories[category] = max(combined_categories[category], score)
+                else:
+                    combined_categories[category] = score
+        
+        return is_video_safe, highest_confidence, combined_categories
         
-        # Create a temporary directory to store frames
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            # Open the video
-            video = cv2.VideoCapture(video_file.temporary_file_path() if hasattr(video_file, 'temporary_file_path') else video_file)
-            
-            # Get video properties
-            fps = video.get(cv2.CAP_PROP_FPS)
-            frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = frame_count / fps
-            
-            # Determine number of frames to sample (1 frame per second, max 10 frames)
-            sample_count = min(int(duration), 10)
-            
-            # Calculate frame indices to sample
-            if sample_count <= 1:
-                frame_indices = [0]
-            else:
-                frame_indices = [int(i * frame_count / sample_count) for i in range(sample_count)]
-            
-            results = []
-            
-            # Process each sampled frame
-            for frame_idx in frame_indices:
-                video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                success, frame = video.read()
-                
-                if success:
-                    # Save frame to temporary file
-                    frame_path = os.path.join(tmpdirname, f"frame_{frame_idx}.jpg")
-                    cv2.imwrite(frame_path, frame)
-                    
-                    # Moderate the frame
-                    is_safe, confidence, categories = moderate_image(frame_path)
-                    results.append((is_safe, confidence, categories))
-            
-            video.release()
-            
-            # If any frame is not safe, the whole video is not safe
-            is_video_safe = all(result[0] for result in results)
-            
-            # Get the highest confidence score from unsafe frames
-            if not is_video_safe:
-                unsafe_results = [result for result in results if not result[0]]
-                highest_confidence = max(result[1] for result in unsafe_results) if unsafe_results else 0
-            else:
-                highest_confidence = 0
-            
-            # Combine all categories
-            combined_categories = {}
-            for _, _, categories in results:
-                for category, score in categories.items():
-                    if category in combined_categories:
-                        combined_categories[category] = max(combined_categories[category], score)
-                    else:
-                        combined_categories[category] = score
-            
-            return is_video_safe, highest_confidence, combined_categories
-            
     except Exception as e:
         logger.error(f"Error in video moderation: {str(e)}")
         # Default to manual review if processing fails
         return False, 0, {"error": str(e)}
 
+def _video_source(video_file):
+    """Return a path OpenCV or PyAV can open for an upload, a stored file or a path"""
+    if hasattr(video_file, 'temporary_file_path'):
+        return video_file.temporary_file_path()
+    try:
+        return video_file.path
+    except (AttributeError, NotImplementedError, ValueError):
+        return video_file
+
+def _sample_indices(frame_count, fps, max_frames):
+    """Evenly spaced frame indices: 1 frame per second, at most max_frames"""
+    duration = frame_count / fps if fps else 0
+    sample_count = min(int(duration), max_frames)
+    if sample_count <= 1:
+        return [0]
+    return [int(i * frame_count / sample_count) for i in range(sample_count)]
+
+def _sample_frames(source, max_frames):
+    """
+    Decode the sampled frames in a single sequential pass. grab() advances
+    without converting the frame; only sampled frames are retrieved. This
+    avoids seeking, which re-decodes from the previous keyframe every time.
+    """
+    video = cv2.VideoCapture(source)
+    try:
+        fps = video.get(cv2.CAP_PROP_FPS)
+        frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        wanted = set(_sample_indices(frame_count, fps, max_frames))
+        last_wanted = max(wanted)
+        
+        frames = []
+        frame_idx = 0
+        while frame_idx <= last_wanted and video.grab():
+            if frame_idx in wanted:
+                success, frame = video.retrieve()
+                if success:
+                    frames.append(frame)
+            frame_idx += 1
+        return frames
+    finally:
+        video.release()
+
+def _sample_keyframes(source, max_frames):
+    """
+    Decode only keyframes with PyAV, taking the first keyframe at or after each
+    sample time. Returns None when PyAV is not installed so the caller falls
+    back to sequential decoding.
+    """
+    try:
+        import av
+    except ImportError:
+        logger.warning("MODERATION_VIDEO_KEYFRAMES_ONLY is set but PyAV is not installed; decoding all frames")
+        return None
+    
+    with av.open(source) as container:
+        stream = container.streams.video[0]
+        # Let the decoder skip every frame that is not a keyframe
+        stream.codec_context.skip_frame = 'NONKEY'
+        
+        if stream.duration and stream.time_base:
+            duration = float(stream.duration * stream.time_base)
+        else:
+            duration = container.duration / av.time_base if container.duration else 0
+        sample_count = max(min(int(duration), max_frames), 1)
+        targets = [i * duration / sample_count for i in range(sample_count)]
+        
+        frames = []
+        for frame in container.decode(stream):
+            if frame.time is not None and frame.time < targets[len(frames)]:
+                continue
+            frames.append(frame.to_ndarray(format='bgr24'))
+            if len(frames) == len(targets):
+                break
+        return frames
+
 # Option 5: Simple color analysis for blood detection (very basic)
+# IMREAD_REDUCED_* decode flags by downscale factor
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+def _load_reduced_image(image_file, max_side):
+    """
+    Load an image with its longer side close to max_side. Encoded images are
+    decoded at reduced resolution by the codec itself (JPEG decodes straight
+    to 1/2, 1/4 or 1/8 scale), so the full-size bitmap is never materialised.
+    Decoded frames are subsampled with a strided view, which copies nothing.
+    """
+    if isinstance(image_file, np.ndarray):
+        step = max(1, max(image_file.shape[:2]) // max_side)
+        return image_file[::step, ::step]
+    
+    data = _read_image_bytes(image_file)
+    
+    # Read only the header to learn the size
+    try:
+        with Image.open(io.BytesIO(data)) as header:
+            longest_side = max(header.size)
+    except Exception:
+        longest_side = 0
+    
+    flags = cv2.IMREAD_COLOR
+    for factor, reduced_flag in _REDUCED_DECODE_FLAGS:
+        if longest_side // factor >= max_side:
+            flags = reduced_flag
+            break
+    return _decode_image(data, flags)
+
+# OpenCV's 8-bit BGR to HSV conversion divides through these 12-bit fixed-point
+# tables (saturation 255/v, hue 30/diff); reusing them reproduces its rounding
+_HSV_SHIFT = 12
+_SATURATION_DIV = np.zeros(256, np.int32)
+_SATURATION_DIV[1:] = np.rint((255 << _HSV_SHIFT) / np.arange(1, 256))
+_HUE_DIV = np.zeros(256, np.int32)
+_HUE_DIV[1:] = np.rint((180 << _HSV_SHIFT) / (6.0 * np.arange(1, 256)))
+
+def _red_fraction(img):
+    """
+    Fraction of blood-red pixels, i.e. OpenCV HSV hue 0-10 or 160-180 with
+    saturation and value of at least 60, computed straight from BGR in one
+    vectorised pass instead of a full HSV copy plus two inRange masks.
+    Matches cv2.cvtColor(COLOR_BGR2HSV) + inRange pixel for pixel on 8-bit input.
+    """
+    b = img[..., 0].astype(np.int32)
+    g = img[..., 1].astype(np.int32)
+    r = img[..., 2].astype(np.int32)
+    # Only pixels whose red channel is the maximum (V) can have a hue near red
+    diff = np.clip(r - np.minimum(g, b), 0, 255)
+    half = 1 << (_HSV_SHIFT - 1)
+    saturation = (diff * _SATURATION_DIV[r] + half) >> _HSV_SHIFT
+    hue = ((g - b) * _HUE_DIV[diff] + half) >> _HSV_SHIFT
+    red = (
+        (r >= g) & (r >= b)
+        & (r >= 60)  # value
+        & (saturation >= 60)
+        # hue 0-10, or 160-180: OpenCV wraps negative hues to 180 + hue
+        & (hue >= -20) & (hue <= 10)
+    )
+    return float(np.count_nonzero(red)) / red.size if red.size else 0.0
+
 def detect_blood_in_image(image_file):
     """
     A very basic approach to detect potential blood in an image based on color analysis.
     This is not comprehensive but can serve as a simple first-pass filter.
+    The image is analysed at reduced resolution (BLOOD_DETECTION_MAX_SIDE).
     Returns a tuple (is_safe, confidence, categories)
     """
     try:
-        # Load image
-        if hasattr(image_file, 'read'):
-            # Convert file-like object to numpy array
-            image_bytes = np.frombuffer(image_file.read(), np.uint8)
-            image_file.seek(0)  # Reset file pointer
-            img = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
-        else:
-            # Load from path
-            img = cv2.imread(image_file)
+        max_side = int(getattr(settings, 'BLOOD_DETECTION_MAX_SIDE', 256))
+        img = _load_reduced_image(image_file, max_side)
         
         if img is None:
             return False, 0, {"error": "Unable to load image"}
         
-        # Convert to HSV color space which is better for color analysis
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        red_percentage = _red_fraction(img)
         
-        # Define range for blood-red color
-        # HSV range for blood red: Hue 0-10 or 160-180, Saturation 60-255, Value 60-255
-        lower_red1 = np.array([0, 60, 60])
-        upper_red1 = np.array([10, 255, 255])
-        lower_red2 = np.array([160, 60, 60])
-        upper_red2 = np.array([180, 255, 255])
-        
-        # Create masks for red regions
-        mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-        mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-        mask = cv2.bitwise_or(mask1, mask2)
-        
-        # Calculate percentage of red pixels
-        red_pixel_count = cv2.countNonZero(mask)
-        total_pixels = img.shape[0] * img.shape[1]
-        red_percentage = red_pixel_count / total_pixels
-        
-        # If percentage of red pixels is above threshold, flag as potential blood
-        threshold = 0.1  # 10% of the image is red
+        # Flag as potential blood when the red share reaches BLOOD_DETECTION_THRESHOLD
+        threshold = float(getattr(settings, 'BLOOD_DETECTION_THRESHOLD', 0.1))
         blood_score = min(1.0, red_percentage * 5)  # Scale up to get a 0-1 score
         
-        is_safe = blood_score < threshold
+        is_safe = red_percentage < threshold
         
         categories = {
             "blood_detection": blood_score,
@@ -436,4 +777,4 @@ def detect_blood_in_image(image_file):
         
     except Exception as e:
         logger.error(f"Error in blood detection: {str(e)}")
-        return False, 0, {"error": str(e)} 
\ No newline at end of file
+        return False, 0, {"error": str(e)}
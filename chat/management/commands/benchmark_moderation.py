@@ -0,0 +1,231 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from chat.content_moderation import detect_blood_in_image, moderate_image, moderate_images_batch, moderate_video
+
+# Backends that can be benchmarked; remote APIs are replaced by a local stub server
+LOCAL_BACKENDS = ('nudenet', 'tensorflow')
+STUB_BACKENDS = ('sightengine',)
+
+# Verdict cache alias that stores nothing, so every call reaches the backend
+BENCHMARK_CACHES = {
+    **settings.CACHES,
+    'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def _write_image(path, rng, width, height, red=False):
+    """A JPEG with a gradient, random shapes and noise; `red` adds a large blood-coloured area"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.dstack([x + 0 * y, (x + y) / 2, y + 0 * x]).astype(np.uint8)
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(img, center, int(rng.integers(10, max(11, min(width, height) // 4))), color, -1)
+    if red:
+        cv2.rectangle(img, (0, 0), (width // 2, height // 2), (20, 10, 170), -1)
+    noise = rng.integers(-12, 12, img.shape, dtype=np.int16)
+    img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+def _write_video(path, rng, width, height, seconds, fps=25):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for frame_number in range(seconds * fps):
+        # Scroll the background so consecutive frames differ
+        writer.write(np.roll(base, frame_number * 4, axis=1))
+    writer.release()
+
+def _start_stub_server(latency):
+    """Local HTTP server answering like the Sightengine check endpoint after `latency` seconds"""
+    body = json.dumps({
+        'status': 'success',
+        'nudity': {'raw': 0.01},
+        'gore': {'prob': 0.01},
+        'offensive': {'prob': 0.01},
+    }).encode()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Otherwise Nagle holds the response back for the client's delayed ACK
+        # (~40ms) on every keep-alive request, which would swamp `latency`
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class Command(BaseCommand):
+    help = 'Benchmark content moderation on a generated image and video corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backends', default='sightengine',
+            help=f"Comma-separated backends: {', '.join(LOCAL_BACKENDS + STUB_BACKENDS)}"
+        )
+        parser.add_argument('--images', type=int, default=40, help='Number of generated images')
+        parser.add_argument('--videos', type=int, default=3, help='Number of generated videos')
+        parser.add_argument('--width', type=int, default=1280, help='Width of generated media')
+        parser.add_argument('--height', type=int, default=960, help='Height of generated media')
+        parser.add_argument('--video-seconds', type=int, default=5, help='Length of generated videos')
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'MODERATION_BATCH_SIZE', 8),
+            help='Images per moderate_images_batch call in the throughput run'
+        )
+        parser.add_argument('--stub-latency', type=float, default=80, help='Milliseconds the stub API takes per request')
+        parser.add_argument('--no-cascade', action='store_true', help='Skip the MODERATION_CASCADE pre-filters')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the generated corpus')
+
+    def handle(self, *args, **options):
+        backends = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        unknown = set(backends) - set(LOCAL_BACKENDS + STUB_BACKENDS)
+        if unknown:
+            raise CommandError(f"Unknown backend(s): {', '.join(sorted(unknown))}")
+
+        with tempfile.TemporaryDirectory(prefix='moderation-benchmark-') as corpus_dir:
+            images, videos = self.build_corpus(corpus_dir, options)
+
+            self.report('detect_blood_in_image', self.time_calls(detect_blood_in_image, images))
+
+            for backend in backends:
+                overrides = {
+                    'CACHES': BENCHMARK_CACHES,
+                    'MODERATION_VERDICT_CACHE': 'benchmark',
+                    'CONTENT_MODERATION_SERVICE': backend,
+                }
+                if options['no_cascade']:
+                    overrides['MODERATION_CASCADE'] = []
+
+                server = None
+                if backend in STUB_BACKENDS:
+                    server = _start_stub_server(options['stub_latency'] / 1000)
+                    overrides.update(
+                        SIGHTENGINE_API_URL=f'http://127.0.0.1:{server.server_port}',
+                        SIGHTENGINE_API_USER='benchmark',
+                        SIGHTENGINE_API_SECRET='benchmark',
+                    )
+                try:
+                    with override_settings(**overrides):
+                        self.benchmark_backend(backend, images, videos, options)
+                finally:
+                    if server:
+                        server.shutdown()
+
+    def build_corpus(self, corpus_dir, options):
+        rng = np.random.default_rng(options['seed'])
+        width, height = options['width'], options['height']
+        started = time.monotonic()
+
+        images = []
+        for number in range(options['images']):
+            path = os.path.join(corpus_dir, f'image_{number}.jpg')
+            # Every fourth image has a large red area for the blood detection path
+            _write_image(path, rng, width, height, red=number % 4 == 0)
+            images.append(path)
+
+        videos = []
+        for number in range(options['videos']):
+            path = os.path.join(corpus_dir, f'video_{number}.mp4')
+            _write_video(path, rng, width, height, options['video_seconds'])
+            videos.append(path)
+
+        self.stdout.write(
+            f'Generated {len(images)} image(s) and {len(videos)} video(s) at {width}x{height} '
+            f'in {time.monotonic() - started:.1f}s'
+        )
+        return images, videos
+
+    def benchmark_backend(self, backend, images, videos, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Backend: {backend}'))
+        if backend in LOCAL_BACKENDS:
+            from chat.content_moderation import SERVICE_MODELS, get_moderation_model
+            try:
+                # Load outside the timings, as a warmed worker would have
+                for name in SERVICE_MODELS[backend]:
+                    get_moderation_model(name)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'  Skipped: {str(e)}'))
+                return
+
+        if images:
+            self.report('moderate_image', self.time_calls(moderate_image, images))
+
+            batches = [images[start:start + options['batch_size']] for start in range(0, len(images), options['batch_size'])]
+            started = time.monotonic()
+            for batch in batches:
+                moderate_images_batch(batch)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"  moderate_images_batch: {len(images) / elapsed:.1f} images/s "
+                f"(batches of {options['batch_size']})"
+            )
+
+        if videos:
+            self.report('moderate_video', self.time_calls(moderate_video, videos))
+
+    def time_calls(self, func, items):
+        """Call func on every item; returns (latencies in seconds, verdicts, peak RSS in KB)"""
+        latencies = []
+        verdicts = []
+        for item in items:
+            started = time.perf_counter()
+            verdicts.append(func(item))
+            latencies.append(time.perf_counter() - started)
+        return latencies, verdicts, _peak_rss_kb()
+
+    def report(self, name, result):
+        latencies, verdicts, peak_rss = result
+        if not latencies:
+            return
+        errors = sum(1 for verdict in verdicts if isinstance(verdict[2], dict) and 'error' in verdict[2])
+        rejected = sum(1 for verdict in verdicts if not verdict[0])
+        total = sum(latencies)
+        line = (
+            f'  {name}: p50 {_percentile(latencies, 50) * 1000:.1f}ms, '
+            f'p90 {_percentile(latencies, 90) * 1000:.1f}ms, '
+            f'p99 {_percentile(latencies, 99) * 1000:.1f}ms, '
+            f'{len(latencies) / total:.1f}/s over {len(latencies)} call(s), '
+            f'{rejected} rejected, {errors} error(s)'
+        )
+        if peak_rss is not None:
+            line += f', peak RSS {peak_rss / 1024:.0f} MB'
+        self.stdout.write(line)
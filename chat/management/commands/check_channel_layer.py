@@ -0,0 +1,60 @@
+import asyncio
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from channels.layers import get_channel_layer
+
+class Command(BaseCommand):
+    help = 'Broadcast test messages through the configured channel layer and report delivery and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listeners', type=int, default=10, help='Number of channels subscribed to the test group')
+        parser.add_argument('--messages', type=int, default=100, help='Number of group messages to broadcast')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for all messages to arrive')
+
+    def handle(self, *args, **options):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            raise CommandError('No channel layer is configured')
+
+        self.stdout.write(f"Backend: {settings.CHANNEL_LAYERS['default']['BACKEND']}")
+        try:
+            delivered, expected, elapsed = asyncio.run(self.broadcast(channel_layer, options))
+        except Exception as e:
+            raise CommandError(f'Channel layer check failed: {str(e)}')
+
+        rate = delivered / elapsed if elapsed else 0
+        self.stdout.write(f'Delivered {delivered}/{expected} messages in {elapsed:.2f}s ({rate:.0f} msg/s)')
+        if delivered < expected:
+            raise CommandError('Some messages were not delivered; check capacity and expiry settings')
+        self.stdout.write(self.style.SUCCESS('Channel layer OK'))
+
+    async def broadcast(self, channel_layer, options):
+        group_name = f'layer_check_{uuid.uuid4().hex[:12]}'
+        channels = [await channel_layer.new_channel() for _ in range(options['listeners'])]
+        for channel_name in channels:
+            await channel_layer.group_add(group_name, channel_name)
+
+        received = dict.fromkeys(channels, 0)
+
+        async def listen(channel_name):
+            while received[channel_name] < options['messages']:
+                await channel_layer.receive(channel_name)
+                received[channel_name] += 1
+
+        started = time.monotonic()
+        listeners = [asyncio.ensure_future(listen(channel_name)) for channel_name in channels]
+        try:
+            for number in range(options['messages']):
+                await channel_layer.group_send(group_name, {'type': 'layer.check', 'number': number})
+                # Let listeners drain between sends, as live consumers would
+                await asyncio.sleep(0)
+            done, pending = await asyncio.wait(listeners, timeout=options['timeout'])
+            for task in pending:
+                task.cancel()
+            return sum(received.values()), options['messages'] * len(channels), time.monotonic() - started
+        finally:
+            for channel_name in channels:
+                await channel_layer.group_discard(group_name, channel_name)
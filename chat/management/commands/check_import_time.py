@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+def _parse_importtime(output):
+    """Return [(module, self_us, cumulative_us, depth)] from `python -X importtime` output"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|', 2)
+        # Nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+class Command(BaseCommand):
+    help = (
+        'Import the web entry points in a fresh interpreter with -X importtime and fail '
+        'if startup exceeds STARTUP_IMPORT_BUDGET_MS or loads a STARTUP_FORBIDDEN_IMPORTS module'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--budget-ms', type=float, default=getattr(settings, 'STARTUP_IMPORT_BUDGET_MS', 800),
+            help='Maximum cumulative import time of the entry points'
+        )
+        parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list')
+        parser.add_argument(
+            'modules', nargs='*',
+            help='Modules to import after django.setup() (default: the ASGI application and ROOT_URLCONF)'
+        )
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or [settings.ASGI_APPLICATION.rsplit('.', 1)[0], settings.ROOT_URLCONF]
+        code = 'import django; django.setup()\n' + ''.join(f'import {module}\n' for module in modules)
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'chat_project.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True, env=env
+        )
+        if result.returncode:
+            raise CommandError(f'Importing {", ".join(modules)} failed:\n{result.stderr[-2000:]}')
+
+        entries = _parse_importtime(result.stderr)
+        imported = {name for name, _, _, _ in entries}
+        total_ms = sum(cumulative for _, _, cumulative, depth in entries if depth == 0) / 1000
+
+        self.stdout.write(f'Imported {", ".join(modules)}: {len(entries)} modules in {total_ms:.0f}ms')
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            self.stdout.write(f'Peak RSS of the import: {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MB')
+        self.stdout.write('Slowest imports (self / cumulative):')
+        for name, self_us, cumulative, _ in sorted(entries, key=lambda entry: entry[1], reverse=True)[:options['top']]:
+            self.stdout.write(f'  {self_us / 1000:7.1f}ms {cumulative / 1000:7.1f}ms  {name}')
+
+        problems = []
+        forbidden = [module for module in getattr(settings, 'STARTUP_FORBIDDEN_IMPORTS', []) if module in imported]
+        if forbidden:
+            problems.append(f'heavy modules loaded at startup: {", ".join(forbidden)}')
+        if total_ms > options['budget_ms']:
+            problems.append(f'{total_ms:.0f}ms is over the {options["budget_ms"]:.0f}ms budget')
+        if problems:
+            raise CommandError('Startup import check failed: ' + '; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Startup imports within budget'))
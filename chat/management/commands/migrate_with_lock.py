@@ -0,0 +1,79 @@
+import time
+import zlib
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.migrations.executor import MigrationExecutor
+
+# Advisory lock id shared by every release process migrating this database
+MIGRATION_LOCK_ID = zlib.crc32(b'socialchat.migrate')
+
+class Command(BaseCommand):
+    help = (
+        'Apply pending migrations once per release. Concurrent runs wait on a '
+        'database advisory lock, and the command returns at once when nothing is pending.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to migrate')
+        parser.add_argument('--lock-timeout', type=float, default=300, help='Seconds to wait for another release to finish migrating')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        started = time.monotonic()
+
+        if not self.pending_migrations(connection):
+            self.stdout.write(f'No migrations to apply ({(time.monotonic() - started) * 1000:.0f}ms)')
+            return
+
+        with self.migration_lock(connection, options['lock_timeout']):
+            # Another release may have migrated while this one waited for the lock
+            pending = self.pending_migrations(connection)
+            if not pending:
+                self.stdout.write('Migrations were applied by another process')
+                return
+            self.stdout.write(f'Applying {len(pending)} migration(s)')
+            call_command('migrate', database=options['database'], interactive=False, verbosity=options['verbosity'])
+
+        self.stdout.write(self.style.SUCCESS(f'Migrations applied in {time.monotonic() - started:.1f}s'))
+
+    def pending_migrations(self, connection):
+        executor = MigrationExecutor(connection)
+        return executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+    def migration_lock(self, connection, timeout):
+        if connection.vendor == 'postgresql':
+            return PostgresAdvisoryLock(connection, timeout)
+        # SQLite serialises writers itself and is only used with a single process
+        return NoLock()
+
+class NoLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+class PostgresAdvisoryLock:
+    """Session-level pg_advisory_lock on MIGRATION_LOCK_ID, polled until `timeout`"""
+
+    def __init__(self, connection, timeout):
+        self.connection = connection
+        self.timeout = timeout
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        with self.connection.cursor() as cursor:
+            while True:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [MIGRATION_LOCK_ID])
+                if cursor.fetchone()[0]:
+                    return self
+                if time.monotonic() >= deadline:
+                    raise CommandError('Timed out waiting for another process to finish migrating')
+                time.sleep(1)
+
+    def __exit__(self, *exc_info):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [MIGRATION_LOCK_ID])
+        return False
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat.models import Profile, TimelineEntry, backfill_timeline
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized home feed timelines from posts and friendships'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Only rebuild the timeline of this user')
+        parser.add_argument(
+            '--limit', type=int, default=getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 200),
+            help='Number of recent posts copied from each author'
+        )
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.all()
+        if options['username']:
+            profiles = profiles.filter(user__username=options['username'])
+        
+        rebuilt = 0
+        for profile in profiles.iterator():
+            TimelineEntry.objects.filter(owner=profile).delete()
+            
+            # The user's own posts plus the recent posts of every friend
+            backfill_timeline(profile, profile, limit=options['limit'])
+            for friend in profile.friends.all():
+                backfill_timeline(profile, friend, limit=options['limit'])
+            
+            rebuilt += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} timeline(s)'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from chat.models import Post, Comment, PostReaction, CommentReaction, REACTION_TYPES
+
+def count_subquery(model, foreign_key, **filters):
+    """Correlated COUNT of model rows pointing at the outer row, 0 when there are none"""
+    counts = model.objects.filter(**{foreign_key: OuterRef('pk')}, **filters).order_by().values(foreign_key).annotate(
+        total=Count('pk')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+def reaction_counter_values(reaction_model, foreign_key):
+    """Recomputed values for the total and per-type reaction counters"""
+    values = {'reaction_count': count_subquery(reaction_model, foreign_key)}
+    for reaction_type, _ in REACTION_TYPES:
+        values[f'{reaction_type}_count'] = count_subquery(reaction_model, foreign_key, reaction_type=reaction_type)
+    return values
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized reaction and comment counters on posts and comments'
+
+    def handle(self, *args, **options):
+        post_values = reaction_counter_values(PostReaction, 'post')
+        post_values['comment_count'] = count_subquery(Comment, 'post')
+        updated_posts = Post.objects.update(**post_values)
+        self.stdout.write(f'Reconciled counters on {updated_posts} post(s)')
+        
+        updated_comments = Comment.objects.update(**reaction_counter_values(CommentReaction, 'comment'))
+        self.stdout.write(f'Reconciled counters on {updated_comments} comment(s)')
+        
+        self.stdout.write(self.style.SUCCESS('Counter reconciliation completed'))
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Pool processes are spawned fresh and import this module before Django is
+# set up, so chat models are only imported inside the functions below.
+
+def _init_worker_process():
+    """Set up Django in a freshly spawned pool process and load its models"""
+    import django
+    django.setup()
+    _warm_models()
+
+def _warm_models():
+    if getattr(settings, 'MODERATION_WARM_MODELS', True):
+        from chat.content_moderation import warm_moderation_models
+        return warm_moderation_models()
+    return {}
+
+def _process_jobs(job_ids):
+    from chat.moderation_queue import process_jobs
+    return process_jobs(job_ids)
+
+def _create_pool(processes):
+    # Spawned processes keep their own DB connections and loaded models
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker_process
+    )
+
+class Command(BaseCommand):
+    help = 'Process queued content moderation jobs, running inference in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=getattr(settings, 'MODERATION_WORKER_PROCESSES', 2),
+            help='Number of inference processes; 0 runs jobs in this process'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=getattr(settings, 'MODERATION_WORKER_POLL_INTERVAL', 2.0),
+            help='Seconds to wait when the queue is empty'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'MODERATION_BATCH_SIZE', 8),
+            help='Number of jobs handed to one process and moderated as one inference batch'
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        from chat.moderation_queue import claim_jobs, release_jobs
+
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        processes = options['processes']
+        batch_size = options['batch_size']
+
+        pool = None
+        if processes > 0:
+            pool = _create_pool(processes)
+        else:
+            for name, stats in _warm_models().items():
+                self.stdout.write(f"Loaded {name} in {stats['load_seconds']}s (+{stats['rss_increase_kb']} KB)")
+
+        self.stdout.write(f'Moderation worker {worker_id} started with {processes} process(es)')
+        processed = 0
+        try:
+            while True:
+                job_ids = claim_jobs(worker_id, batch_size * max(processes, 1))
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                batches = [job_ids[start:start + batch_size] for start in range(0, len(job_ids), batch_size)]
+                if pool:
+                    try:
+                        results = list(pool.map(_process_jobs, batches))
+                    except BrokenProcessPool as e:
+                        # An inference process died (e.g. killed for memory): requeue
+                        # the jobs it left running and carry on with a fresh pool
+                        self.stderr.write(f'Inference process died, restarting the pool: {str(e)}')
+                        release_jobs(job_ids, e)
+                        pool.shutdown(wait=False)
+                        pool = _create_pool(processes)
+                        results = []
+                    except Exception as e:
+                        # A batch raised instead of recording its verdicts; jobs
+                        # other batches finished are no longer running and keep them
+                        self.stderr.write(f'Moderation batch failed: {str(e)}')
+                        release_jobs(job_ids, e)
+                        results = []
+                else:
+                    results = []
+                    for batch in batches:
+                        try:
+                            results.append(_process_jobs(batch))
+                        except Exception as e:
+                            self.stderr.write(f'Moderation batch failed: {str(e)}')
+                            release_jobs(batch, e)
+
+                processed += len(job_ids)
+                for statuses in results:
+                    for job_id, status in statuses.items():
+                        self.stdout.write(f'Job {job_id}: {status}')
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping moderation worker')
+        finally:
+            if pool:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s)'))
@@ -0,0 +1,115 @@
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+
+from .models import ChatRoom, Message
+
+logger = logging.getLogger(__name__)
+
+# Write-behind buffers of this process, one per event loop; flushed at exit
+_buffers = {}
+
+
+def write_messages(messages):
+    """
+    Insert buffered messages with one bulk_create and send post_save for each,
+    so stream publishing and unread counts behave as for Message.objects.create.
+    A batch that fails is retried row by row so one bad row loses nothing else.
+    """
+    # Fresh rooms with their participants, shared by every message of the batch
+    rooms = ChatRoom.objects.prefetch_related('participants').in_bulk({message.room_id for message in messages})
+    for message in messages:
+        message.room = rooms.get(message.room_id, message.room)
+
+    try:
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            for message in messages:
+                post_save.send(sender=Message, instance=message, created=True, update_fields=None, raw=False, using=message._state.db)
+        return len(messages)
+    except Exception as e:
+        logger.error(f"Error writing {len(messages)} buffered message(s), saving one by one: {str(e)}")
+
+    saved = 0
+    for message in messages:
+        message.pk = None
+        message._state.adding = True
+        try:
+            # A savepoint per row, so one failure does not break an enclosing transaction
+            with transaction.atomic():
+                message.save()
+            saved += 1
+        except Exception as e:
+            logger.error(f"Error saving buffered message from profile {message.sender_id} in room {message.room_id}: {str(e)}")
+    return saved
+
+
+class MessageWriteBuffer:
+    """
+    Collects chat messages and writes them in batches, after CHAT_WRITE_BUFFER_INTERVAL_MS
+    or as soon as CHAT_WRITE_BUFFER_SIZE messages are waiting. Flushes run one at a
+    time, so messages are stored in the order they arrived.
+    """
+
+    def __init__(self, max_size, interval):
+        self.max_size = max_size
+        self.interval = interval
+        self.pending = []
+        self.flush_handle = None
+        self.flush_lock = asyncio.Lock()
+
+    def add(self, room, sender, content):
+        self.pending.append(Message(room=room, sender=sender, content=content))
+        if len(self.pending) >= self.max_size:
+            self._cancel_timer()
+            asyncio.ensure_future(self.flush())
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(
+                self.interval, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        async with self.flush_lock:
+            self._cancel_timer()
+            batch, self.pending = self.pending, []
+            if batch:
+                await database_sync_to_async(write_messages)(batch)
+
+    def flush_sync(self):
+        """Write whatever is still pending; for interpreter shutdown, when no loop runs"""
+        self._cancel_timer()
+        batch, self.pending = self.pending, []
+        if batch:
+            logger.info(f"Writing {len(batch)} buffered message(s) at shutdown")
+            write_messages(batch)
+
+    def _cancel_timer(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+
+def get_message_buffer():
+    """Return the write-behind buffer of the running event loop"""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = MessageWriteBuffer(
+            max_size=getattr(settings, 'CHAT_WRITE_BUFFER_SIZE', 50),
+            interval=getattr(settings, 'CHAT_WRITE_BUFFER_INTERVAL_MS', 20) / 1000
+        )
+    return buffer
+
+
+@atexit.register
+def _flush_buffers_at_exit():
+    for buffer in list(_buffers.values()):
+        try:
+            buffer.flush_sync()
+        except Exception as e:
+            logger.error(f"Could not write buffered messages at shutdown: {str(e)}")
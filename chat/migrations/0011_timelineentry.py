@@ -0,0 +1,45 @@
+# Generated by Django 4.2.9 on 2026-10-17 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_timelines(apps, schema_editor):
+    """Build timelines for existing users from their own and their friends' recent posts"""
+    Profile = apps.get_model('chat', 'Profile')
+    Post = apps.get_model('chat', 'Post')
+    TimelineEntry = apps.get_model('chat', 'TimelineEntry')
+    
+    for profile in Profile.objects.all().iterator():
+        author_ids = [profile.id] + list(profile.friends.values_list('id', flat=True))
+        entries = [
+            TimelineEntry(owner_id=profile.id, post_id=post_id, author_id=author_id, created_at=created_at)
+            for author_id in author_ids
+            for post_id, created_at in Post.objects.filter(author_id=author_id).order_by('-created_at', '-id').values_list('id', 'created_at')[:200]
+        ]
+        TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.profile')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='chat.profile')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='chat.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-created_at', '-post'], name='chat_timeline_owner_idx')],
+                'unique_together': {('owner', 'post')},
+            },
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 4.2.9 on 2026-10-17 12:07
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+REACTION_TYPES = ['like', 'love', 'haha', 'wow', 'sad', 'angry']
+
+
+def populate_counters(apps, schema_editor):
+    """Fill the new counters from the existing reactions and comments"""
+    Post = apps.get_model('chat', 'Post')
+    Comment = apps.get_model('chat', 'Comment')
+    PostReaction = apps.get_model('chat', 'PostReaction')
+    CommentReaction = apps.get_model('chat', 'CommentReaction')
+    
+    def count_subquery(model, foreign_key, **filters):
+        counts = model.objects.filter(**{foreign_key: OuterRef('pk')}, **filters).order_by().values(foreign_key).annotate(
+            total=Count('pk')
+        ).values('total')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+    
+    def reaction_counter_values(reaction_model, foreign_key):
+        values = {'reaction_count': count_subquery(reaction_model, foreign_key)}
+        for reaction_type in REACTION_TYPES:
+            values[f'{reaction_type}_count'] = count_subquery(reaction_model, foreign_key, reaction_type=reaction_type)
+        return values
+    
+    Post.objects.update(comment_count=count_subquery(Comment, 'post'), **reaction_counter_values(PostReaction, 'post'))
+    Comment.objects.update(**reaction_counter_values(CommentReaction, 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='angry_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='haha_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='love_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reaction_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='sad_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='wow_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='angry_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='haha_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='love_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reaction_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='sad_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='wow_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2026-10-17 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_post_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', '-id'], name='chat_message_room_id_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.9 on 2026-10-17 12:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Max, Q
+
+
+def populate_read_cursors(apps, schema_editor):
+    """Start each participant's cursor after the last message they sent or had marked read"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    RoomReadCursor = apps.get_model('chat', 'RoomReadCursor')
+    
+    cursors = []
+    for room in ChatRoom.objects.all().iterator():
+        for profile_id in room.participants.values_list('id', flat=True):
+            last_read_id = Message.objects.filter(
+                Q(sender_id=profile_id) | Q(is_read=True),
+                room_id=room.id
+            ).aggregate(last_id=Max('id'))['last_id']
+            cursors.append(RoomReadCursor(room_id=room.id, profile_id=profile_id, last_read_message_id=last_read_id or 0))
+    RoomReadCursor.objects.bulk_create(cursors, ignore_conflicts=True, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_message_room_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_read_cursors', to='chat.profile')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='chat.chatroom')),
+            ],
+            options={
+                'unique_together': {('room', 'profile')},
+            },
+        ),
+        migrations.RunPython(populate_read_cursors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.9 on 2026-10-17 12:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_roomreadcursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_type', models.CharField(choices=[('post_image', 'Post Image'), ('post_video', 'Post Video'), ('message_image', 'Message Image'), ('message_video', 'Message Video'), ('avatar', 'Profile Avatar'), ('comment', 'Comment')], max_length=20)),
+                ('content_id', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('moderation_status', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='chat.contentmoderationstatus')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='chat_modjob_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.9 on 2026-10-17 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_moderationjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contentmoderationstatus',
+            index=models.Index(fields=['status', '-id'], name='chat_modstatus_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contentmoderationstatus',
+            index=models.Index(fields=['status', 'content_type', '-id'], name='chat_modstatus_type_idx'),
+        ),
+    ]
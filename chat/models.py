@@ -1,13 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q, F
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.conf import settings
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
 import logging
 
-# Import needed for moderation
-from .content_moderation import moderate_image, moderate_video
-
 logger = logging.getLogger(__name__)
 
 def get_default_avatar_path():
@@ -42,6 +44,45 @@ class ContentModerationStatus(models.Model):
     moderation_data = models.JSONField(default=dict, blank=True)  # Store detailed moderation results
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Serves the dashboard's per-status pages and its grouped counts
+            models.Index(fields=['status', '-id'], name='chat_modstatus_status_idx'),
+            models.Index(fields=['status', 'content_type', '-id'], name='chat_modstatus_type_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.content_type} ({self.content_id}): {self.status}"
+
+class ModerationJob(models.Model):
+    """
+    Durable queue entry for moderating uploaded media outside the request.
+    Rows are claimed and processed by the run_moderation_worker command.
+    """
+    JOB_STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    content_type = models.CharField(max_length=20, choices=ContentModerationStatus.CONTENT_TYPE_CHOICES)
+    content_id = models.PositiveIntegerField()
+    moderation_status = models.ForeignKey(ContentModerationStatus, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    status = models.CharField(max_length=10, choices=JOB_STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='chat_modjob_status_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.content_type} ({self.content_id}): {self.status}"
 
@@ -93,6 +134,16 @@ class Post(models.Model):
     is_moderated = models.BooleanField(default=False)
     moderation_passed = models.BooleanField(default=True)  # Innocent until proven guilty
     
+    # Denormalized counters, kept in step by signal handlers (see reconcile_counters)
+    comment_count = models.PositiveIntegerField(default=0)
+    reaction_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    love_count = models.PositiveIntegerField(default=0)
+    haha_count = models.PositiveIntegerField(default=0)
+    wow_count = models.PositiveIntegerField(default=0)
+    sad_count = models.PositiveIntegerField(default=0)
+    angry_count = models.PositiveIntegerField(default=0)
+    
     def __str__(self):
         return f"{self.author.user.username}: {self.content[:30]}..."
 
@@ -155,6 +206,15 @@ class Comment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_hidden = models.BooleanField(default=False)  # For moderation purposes
     
+    # Denormalized counters, kept in step by signal handlers (see reconcile_counters)
+    reaction_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    love_count = models.PositiveIntegerField(default=0)
+    haha_count = models.PositiveIntegerField(default=0)
+    wow_count = models.PositiveIntegerField(default=0)
+    sad_count = models.PositiveIntegerField(default=0)
+    angry_count = models.PositiveIntegerField(default=0)
+    
     def __str__(self):
         return f"Comment by {self.author.user.username} on {self.post}"
 
@@ -192,6 +252,22 @@ class Repost(models.Model):
     def __str__(self):
         return f"Repost of {self.original_post} by {self.repost.author.user.username}"
 
+class TimelineEntry(models.Model):
+    """Materialized home feed entry, pushed to each reader when a post is created"""
+    owner = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()  # Copy of post.created_at so the feed is read from this table alone
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='chat_timeline_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.post} in {self.owner.user.username}'s timeline"
+
 class ChatRoom(models.Model):
     name = models.CharField(max_length=100, blank=True)
     participants = models.ManyToManyField(Profile, related_name='chat_rooms')
@@ -226,10 +302,26 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', '-id'], name='chat_message_room_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.sender.user.username}: {self.content[:30]}..."
 
+class RoomReadCursor(models.Model):
+    """Per-participant high-water mark of the last message read in a chat room"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_cursors')
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='room_read_cursors')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('room', 'profile')
+    
+    def __str__(self):
+        return f"{self.profile.user.username} read {self.room} up to {self.last_read_message_id}"
+
 class MessageReaction(models.Model):
     """Model for message reactions"""
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='reactions')
@@ -261,187 +353,222 @@ class BlockedPost(models.Model):
         return f"{self.user.user.username} blocked {self.post}"
 
 # Signal handlers for content moderation
+def enqueue_moderation(content_type, content_id):
+    """
+    Record the content as pending review and queue it for the moderation worker.
+    Runs in the caller's transaction, so the job exists exactly when the upload does.
+    """
+    moderation = ContentModerationStatus.objects.create(
+        content_type=content_type,
+        content_id=content_id,
+        status='pending'
+    )
+    return ModerationJob.objects.create(
+        content_type=content_type,
+        content_id=content_id,
+        moderation_status=moderation
+    )
+
 @receiver(post_save, sender=PostImage)
 def moderate_post_image(sender, instance, created, **kwargs):
-    """Moderate newly uploaded post images"""
+    """Queue newly uploaded post images for moderation"""
     if created and instance.image:
-        try:
-            is_safe, confidence, categories = moderate_image(instance.image)
-            
-            # Create moderation status
-            moderation = ContentModerationStatus.objects.create(
-                content_type='post_image',
-                content_id=instance.id,
-                status='approved' if is_safe else 'rejected',
-                moderation_date=timezone.now(),
-                rejection_reason='Inappropriate content detected' if not is_safe else None,
-                moderation_data=categories
-            )
-            
-            # Update the image moderation status - use try/except in case the column doesn't exist yet
-            try:
-                instance.is_moderated = True
-                instance.moderation_passed = is_safe
-                instance.save(update_fields=['is_moderated', 'moderation_passed'])
-                
-                # Update the post status if the image failed moderation
-                if not is_safe:
-                    post = instance.post
-                    post.moderation_passed = False
-                    post.is_moderated = True
-                    post.save(update_fields=['is_moderated', 'moderation_passed'])
-                    
-                    # Create a blocked post entry for the admin
-                    BlockedPost.objects.create(
-                        user=Profile.objects.filter(user__is_superuser=True).first(),
-                        post=post,
-                        reason=f"Automatic block: Inappropriate image (score: {confidence})"
-                    )
-                    
-                    logger.warning(f"Post {post.id} blocked due to inappropriate image content")
-            except Exception as e:
-                logger.error(f"Error updating moderation status: {str(e)}. Database may need migration.")
-        
-        except Exception as e:
-            logger.error(f"Error processing image moderation for PostImage {instance.id}: {str(e)}")
-            ContentModerationStatus.objects.create(
-                content_type='post_image',
-                content_id=instance.id,
-                status='error',
-                moderation_date=timezone.now(),
-                rejection_reason=str(e)[:50],
-                moderation_data={"error": str(e)}
-            )
+        enqueue_moderation('post_image', instance.id)
 
 @receiver(post_save, sender=PostVideo)
 def moderate_post_video(sender, instance, created, **kwargs):
-    """Moderate newly uploaded post videos"""
+    """Queue newly uploaded post videos for moderation"""
     if created and instance.video:
-        try:
-            is_safe, confidence, categories = moderate_video(instance.video)
-            
-            # Create moderation status
-            moderation = ContentModerationStatus.objects.create(
-                content_type='post_video',
-                content_id=instance.id,
-                status='approved' if is_safe else 'rejected',
-                moderation_date=timezone.now(),
-                rejection_reason='Inappropriate content detected' if not is_safe else None,
-                moderation_data=categories
-            )
-            
-            # Update the video moderation status - use try/except in case the column doesn't exist yet
-            try:
-                instance.is_moderated = True
-                instance.moderation_passed = is_safe
-                instance.save(update_fields=['is_moderated', 'moderation_passed'])
-                
-                # Update the post status if the video failed moderation
-                if not is_safe:
-                    post = instance.post
-                    post.moderation_passed = False
-                    post.is_moderated = True
-                    post.save(update_fields=['is_moderated', 'moderation_passed'])
-                    
-                    # Create a blocked post entry for the admin
-                    BlockedPost.objects.create(
-                        user=Profile.objects.filter(user__is_superuser=True).first(),
-                        post=post,
-                        reason=f"Automatic block: Inappropriate video (score: {confidence})"
-                    )
-                    
-                    logger.warning(f"Post {post.id} blocked due to inappropriate video content")
-            except Exception as e:
-                logger.error(f"Error updating moderation status: {str(e)}. Database may need migration.")
-        
-        except Exception as e:
-            logger.error(f"Error processing video moderation for PostVideo {instance.id}: {str(e)}")
-            ContentModerationStatus.objects.create(
-                content_type='post_video',
-                content_id=instance.id,
-                status='error',
-                moderation_date=timezone.now(),
-                rejection_reason=str(e)[:50],
-                moderation_data={"error": str(e)}
-            )
+        enqueue_moderation('post_video', instance.id)
 
 @receiver(post_save, sender=Message)
 def moderate_message_media(sender, instance, created, **kwargs):
-    """Moderate media in messages"""
+    """Queue media in messages for moderation"""
     if created:
-        # Check for image
         if instance.image:
-            try:
-                is_safe, confidence, categories = moderate_image(instance.image)
-                
-                # Create moderation status
-                ContentModerationStatus.objects.create(
-                    content_type='message_image',
-                    content_id=instance.id,
-                    status='approved' if is_safe else 'rejected',
-                    moderation_date=timezone.now(),
-                    rejection_reason='Inappropriate content detected' if not is_safe else None,
-                    moderation_data=categories
-                )
-                
-                # Update message status - use try/except in case the column doesn't exist yet
-                try:
-                    instance.is_image_moderated = True
-                    instance.image_moderation_passed = is_safe
-                    instance.save(update_fields=['is_image_moderated', 'image_moderation_passed'])
-                    
-                    if not is_safe:
-                        logger.warning(f"Message {instance.id} contained inappropriate image")
-                except Exception as e:
-                    logger.error(f"Error updating image moderation status: {str(e)}. Database may need migration.")
-            
-            except Exception as e:
-                logger.error(f"Error processing image moderation for Message {instance.id}: {str(e)}")
-                ContentModerationStatus.objects.create(
-                    content_type='message_image',
-                    content_id=instance.id,
-                    status='error',
-                    moderation_date=timezone.now(),
-                    rejection_reason=str(e)[:50],
-                    moderation_data={"error": str(e)}
-                )
-        
-        # Check for video
+            enqueue_moderation('message_image', instance.id)
         if instance.video:
-            try:
-                is_safe, confidence, categories = moderate_video(instance.video)
-                
-                # Create moderation status
-                ContentModerationStatus.objects.create(
-                    content_type='message_video',
-                    content_id=instance.id,
-                    status='approved' if is_safe else 'rejected',
-                    moderation_date=timezone.now(),
-                    rejection_reason='Inappropriate content detected' if not is_safe else None,
-                    moderation_data=categories
-                )
-                
-                # Update message status - use try/except in case the column doesn't exist yet
-                try:
-                    instance.is_video_moderated = True
-                    instance.video_moderation_passed = is_safe
-                    instance.save(update_fields=['is_video_moderated', 'video_moderation_passed'])
-                    
-                    if not is_safe:
-                        logger.warning(f"Message {instance.id} contained inappropriate video")
-                except Exception as e:
-                    logger.error(f"Error updating video moderation status: {str(e)}. Database may need migration.")
-            
-            except Exception as e:
-                logger.error(f"Error processing video moderation for Message {instance.id}: {str(e)}")
-                ContentModerationStatus.objects.create(
-                    content_type='message_video',
-                    content_id=instance.id,
-                    status='error',
-                    moderation_date=timezone.now(),
-                    rejection_reason=str(e)[:50],
-                    moderation_data={"error": str(e)}
-                )
+            enqueue_moderation('message_video', instance.id)
+
+# Signal handlers for home feed timelines
+def backfill_timeline(owner, author, limit=None):
+    """
+    Copy the author's most recent posts into the owner's timeline, newest first
+    and TIMELINE_BACKFILL_BATCH posts per query. At most TIMELINE_BACKFILL_LIMIT
+    posts are copied (0 copies the whole history); the home feed of a new friend
+    ends there, and older posts are only on the author's profile.
+    """
+    if limit is None:
+        limit = getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 200)
+    batch_size = getattr(settings, 'TIMELINE_BACKFILL_BATCH', 500)
+    posts = Post.objects.filter(author=author).order_by('-created_at', '-id')
+    copied = 0
+    while not limit or copied < limit:
+        size = min(batch_size, limit - copied) if limit else batch_size
+        batch = list(posts.values_list('id', 'created_at')[:size])
+        if not batch:
+            break
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(owner=owner, post_id=post_id, author=author, created_at=created_at)
+                for post_id, created_at in batch
+            ],
+            ignore_conflicts=True
+        )
+        copied += len(batch)
+        if len(batch) < size:
+            break
+        # Continue after the oldest post copied so far
+        last_id, last_created_at = batch[-1]
+        posts = posts.filter(Q(created_at__lt=last_created_at) | Q(created_at=last_created_at, id__lt=last_id))
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    """Push a new post into the timelines of its author and all of the author's friends"""
+    if created:
+        try:
+            reader_ids = [instance.author_id] + list(instance.author.friends.values_list('id', flat=True))
+            TimelineEntry.objects.bulk_create(
+                [
+                    TimelineEntry(owner_id=reader_id, post=instance, author_id=instance.author_id, created_at=instance.created_at)
+                    for reader_id in reader_ids
+                ],
+                ignore_conflicts=True,
+                batch_size=500
+            )
+        except Exception as e:
+            logger.error(f"Error fanning out Post {instance.id} to timelines: {str(e)}")
+
+@receiver(m2m_changed, sender=Profile.friends.through)
+def sync_timelines_on_friend_change(sender, instance, action, pk_set, **kwargs):
+    """Keep timelines in step with the friends list"""
+    try:
+        if action == 'post_add':
+            for friend in Profile.objects.filter(id__in=pk_set):
+                backfill_timeline(instance, friend)
+                backfill_timeline(friend, instance)
+        elif action == 'post_remove':
+            TimelineEntry.objects.filter(
+                Q(owner=instance, author_id__in=pk_set) | Q(owner_id__in=pk_set, author=instance)
+            ).delete()
+        elif action == 'pre_clear':
+            TimelineEntry.objects.filter(
+                Q(owner=instance) | Q(author=instance)
+            ).exclude(owner=F('author')).delete()
+    except Exception as e:
+        logger.error(f"Error updating timelines for Profile {instance.id}: {str(e)}")
+
+# Signal handlers for denormalized reaction and comment counters
+def _counter_change(field_name, delta):
+    """F() expression adding delta to a counter, never letting it drop below zero"""
+    if delta < 0:
+        return Greatest(F(field_name) + delta, 0)
+    return F(field_name) + delta
+
+def _adjust_reaction_counters(model, pk, reaction_type, delta):
+    """Atomically add delta to the total and per-type reaction counters of a Post or Comment"""
+    changes = {'reaction_count': _counter_change('reaction_count', delta)}
+    if reaction_type in dict(REACTION_TYPES):
+        changes[f'{reaction_type}_count'] = _counter_change(f'{reaction_type}_count', delta)
+    model.objects.filter(pk=pk).update(**changes)
+
+def _move_reaction_counter(model, pk, old_type, new_type):
+    """Atomically move one reaction from one per-type counter to another"""
+    changes = {}
+    if old_type in dict(REACTION_TYPES):
+        changes[f'{old_type}_count'] = _counter_change(f'{old_type}_count', -1)
+    if new_type in dict(REACTION_TYPES):
+        changes[f'{new_type}_count'] = _counter_change(f'{new_type}_count', 1)
+    if changes:
+        model.objects.filter(pk=pk).update(**changes)
+
+def _deleting(origin, model):
+    """
+    True when the delete that sent post_delete started from `model` rows (an
+    instance or a queryset), i.e. the counter's owner is being removed as well
+    """
+    if isinstance(origin, models.QuerySet):
+        return issubclass(origin.model, model)
+    return isinstance(origin, model)
+
+@receiver(pre_save, sender=PostReaction)
+@receiver(pre_save, sender=CommentReaction)
+def remember_previous_reaction_type(sender, instance, **kwargs):
+    """Remember the stored reaction type so a type change can move the counters"""
+    if instance.pk:
+        instance._previous_reaction_type = sender.objects.filter(pk=instance.pk).values_list('reaction_type', flat=True).first()
+
+@receiver(post_save, sender=PostReaction)
+def count_post_reaction(sender, instance, created, **kwargs):
+    if created:
+        _adjust_reaction_counters(Post, instance.post_id, instance.reaction_type, 1)
+    elif getattr(instance, '_previous_reaction_type', instance.reaction_type) != instance.reaction_type:
+        _move_reaction_counter(Post, instance.post_id, instance._previous_reaction_type, instance.reaction_type)
+
+@receiver(post_delete, sender=PostReaction)
+def uncount_post_reaction(sender, instance, origin=None, **kwargs):
+    if _deleting(origin, Post):
+        return
+    _adjust_reaction_counters(Post, instance.post_id, instance.reaction_type, -1)
+
+@receiver(post_save, sender=CommentReaction)
+def count_comment_reaction(sender, instance, created, **kwargs):
+    if created:
+        _adjust_reaction_counters(Comment, instance.comment_id, instance.reaction_type, 1)
+    elif getattr(instance, '_previous_reaction_type', instance.reaction_type) != instance.reaction_type:
+        _move_reaction_counter(Comment, instance.comment_id, instance._previous_reaction_type, instance.reaction_type)
+
+@receiver(post_delete, sender=CommentReaction)
+def uncount_comment_reaction(sender, instance, origin=None, **kwargs):
+    # Deleting a comment also deletes its replies and every reaction on them
+    if _deleting(origin, Post) or _deleting(origin, Comment):
+        return
+    _adjust_reaction_counters(Comment, instance.comment_id, instance.reaction_type, -1)
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(comment_count=_counter_change('comment_count', 1))
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, origin=None, **kwargs):
+    if _deleting(origin, Post):
+        return
+    Post.objects.filter(pk=instance.post_id).update(comment_count=_counter_change('comment_count', -1))
+
+def message_stream_payload(message):
+    """Serialize a message the way the SSE stream sends it"""
+    return {
+        'id': message.id,
+        'content': message.content,
+        'sender': message.sender.user.username,
+        'sender_id': message.sender_id,
+        'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'sent_at': message.timestamp.isoformat()
+    }
+
+@receiver(post_save, sender=Message)
+def publish_saved_message(sender, instance, created, **kwargs):
+    """
+    Announce a stored message on the room's channel layer group once the
+    transaction commits, so stream listeners never have to poll the database.
+    """
+    if not created:
+        return
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    event = {'type': 'message_saved', 'room_id': instance.room_id, 'message': message_stream_payload(instance)}
+
+    def publish():
+        try:
+            async_to_sync(channel_layer.group_send)(f'chat_{instance.room_id}', event)
+        except Exception as e:
+            logger.warning(f"Could not publish message {instance.id} to room {instance.room_id}: {str(e)}")
+
+    transaction.on_commit(publish)
 
 # Continue with your existing models...
 class FriendList(models.Model):
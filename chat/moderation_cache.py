@@ -0,0 +1,152 @@
+import hashlib
+import logging
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Verdicts are keyed by the moderation service too, so switching services
+# never serves a verdict produced by another backend
+CACHE_KEY_PREFIX = 'moderation_verdict'
+
+# Perceptual hashes with fewer set bits carry too little detail to identify an image
+MIN_PERCEPTUAL_BITS = 8
+
+
+def _cache():
+    return caches[getattr(settings, 'MODERATION_VERDICT_CACHE', 'default')]
+
+
+def _media_bytes(image_file):
+    """Raw bytes of an upload or a path"""
+    if hasattr(image_file, 'read'):
+        data = image_file.read()
+        # Reset file pointer for other functions
+        image_file.seek(0)
+        return data
+    with open(image_file, 'rb') as f:
+        return f.read()
+
+
+def _file_sha256(media):
+    """SHA-256 of a file object or path, read in chunks so large videos never sit in memory"""
+    digest = hashlib.sha256()
+    if hasattr(media, 'read'):
+        media.seek(0)
+        for chunk in iter(lambda: media.read(1024 * 1024), b''):
+            digest.update(chunk)
+        media.seek(0)
+    else:
+        with open(media, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _difference_hash(data):
+    """
+    64-bit difference hash (dHash): survives re-encoding, resizing and small
+    colour changes, so re-compressed forwards of the same picture still match.
+    """
+    gray = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    # Ignore tiny differences so flat areas do not flip bits after re-encoding
+    bits = (small[:, 1:].astype(np.int16) - small[:, :-1] > 4).flatten()
+    if bits.sum() < MIN_PERCEPTUAL_BITS:
+        # Near-uniform images all hash alike; match those by exact bytes only
+        return None
+    return f'{int("".join("1" if bit else "0" for bit in bits), 2):016x}'
+
+
+def _keys(service, image_file):
+    """
+    Return (sha256 key, perceptual key or None) for the media, or None for
+    decoded video frames: hashing every raw frame costs more than it saves,
+    and frames of the same video rarely repeat byte for byte
+    """
+    if isinstance(image_file, np.ndarray):
+        return None
+    data = _media_bytes(image_file)
+    sha_key = f'{CACHE_KEY_PREFIX}:{service}:sha256:{hashlib.sha256(data).hexdigest()}'
+    phash = _difference_hash(data) if getattr(settings, 'MODERATION_VERDICT_CACHE_PERCEPTUAL', True) else None
+    phash_key = f'{CACHE_KEY_PREFIX}:{service}:dhash:{phash}' if phash else None
+    return sha_key, phash_key
+
+
+def lookup_verdicts(service, image_files):
+    """
+    Look every image up by exact and perceptual hash. An exact match returns
+    any verdict; a perceptual match only returns rejections, since a picture
+    that looks alike can still differ in exactly the detail that matters.
+    Returns (verdicts, keys): verdicts[i] is the cached (is_safe, confidence,
+    categories) or None on a miss; keys[i] is what store_verdict needs.
+    """
+    keys = []
+    for image_file in image_files:
+        try:
+            keys.append(_keys(service, image_file))
+        except Exception as e:
+            logger.warning(f"Could not hash media for the verdict cache: {str(e)}")
+            keys.append(None)
+
+    lookup = [key for pair in keys if pair for key in pair if key]
+    try:
+        cached = _cache().get_many(lookup) if lookup else {}
+    except Exception as e:
+        logger.warning(f"Moderation verdict cache unavailable: {str(e)}")
+        cached = {}
+
+    verdicts = []
+    for pair in keys:
+        verdict = None
+        if pair:
+            sha_key, phash_key = pair
+            verdict = cached.get(sha_key)
+            if not verdict and phash_key:
+                similar = cached.get(phash_key)
+                verdict = similar if similar and not similar[0] else None
+        verdicts.append(tuple(verdict) if verdict else None)
+    return verdicts, keys
+
+
+def lookup_video_verdict(service, video_file):
+    """
+    Look a whole video up by the SHA-256 of its bytes, so a re-posted video
+    skips frame decoding and inference. Videos are only matched exactly.
+    Returns (verdict or None, key pair for store_verdict).
+    """
+    try:
+        key_pair = (f'{CACHE_KEY_PREFIX}:{service}:video_sha256:{_file_sha256(video_file)}', None)
+    except Exception as e:
+        logger.warning(f"Could not hash media for the verdict cache: {str(e)}")
+        return None, None
+
+    try:
+        verdict = _cache().get(key_pair[0])
+    except Exception as e:
+        logger.warning(f"Moderation verdict cache unavailable: {str(e)}")
+        verdict = None
+    return (tuple(verdict) if verdict else None), key_pair
+
+
+def store_verdict(key_pair, verdict):
+    """
+    Remember a verdict by exact hash, and rejections by perceptual hash too;
+    errors are never cached
+    """
+    is_safe, confidence, categories = verdict
+    if not key_pair or (isinstance(categories, dict) and 'error' in categories):
+        return
+
+    timeout = getattr(settings, 'MODERATION_VERDICT_CACHE_TTL', 86400)
+    try:
+        sha_key, phash_key = key_pair
+        keys = [sha_key, phash_key] if phash_key and not is_safe else [sha_key]
+        _cache().set_many({key: verdict for key in keys}, timeout)
+    except Exception as e:
+        logger.warning(f"Moderation verdict cache unavailable: {str(e)}")
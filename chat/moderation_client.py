@@ -0,0 +1,210 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ModerationAPIError(Exception):
+    """A remote moderation API call failed after all retries"""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+class CircuitOpenError(ModerationAPIError):
+    """Calls are short-circuited because the API kept failing"""
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds; then lets one trial call through (half-open) and
+    closes again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        """Raise CircuitOpenError or let the call through; returns True for the half-open trial call"""
+        with self.lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self.trial_running):
+                raise CircuitOpenError('Circuit open after repeated failures')
+            if state == 'half-open':
+                self.trial_running = True
+                return True
+            return False
+
+    def release_trial(self):
+        """Free the trial slot of a call that ended without recording a result"""
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                # A failed trial call reopens the circuit for another full period
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class ModerationAPIClient:
+    """
+    Shared client for one remote moderation API. Keeps a pooled keep-alive
+    session and wraps every call with a concurrency limit, a rate limit,
+    retries with exponential backoff and a circuit breaker.
+    """
+
+    def __init__(self, name, base_url='', timeout=10.0, connect_timeout=3.05, max_retries=2,
+                 backoff=0.5, max_concurrency=4, rate_limit=0, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        # Retries are handled below so they also count towards the breaker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path='', **kwargs):
+        """
+        Send an HTTP request to the API and return the response.
+        Connection errors, timeouts and RETRY_STATUSES are retried; other
+        4xx responses are returned to the caller as they are.
+        """
+        url = f'{self.base_url}/{path.lstrip("/")}' if self.base_url else path
+        kwargs.setdefault('timeout', self.timeout)
+
+        def send():
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code in RETRY_STATUSES:
+                raise ModerationAPIError(f'{self.name} returned HTTP {response.status_code}', response=response)
+            return response
+
+        return self.call(send, retry_on=(requests.ConnectionError, requests.Timeout, ModerationAPIError))
+
+    def call(self, func, retry_on=(Exception,)):
+        """Run `func` (an SDK call, for example) under the client's limits and breaker"""
+        is_trial = self.breaker.before_call()
+        try:
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                try:
+                    with self.slots:
+                        result = func()
+                except retry_on as e:
+                    if attempt >= self.max_retries:
+                        self.breaker.record_failure()
+                        logger.error(f"{self.name} call failed after {attempt + 1} attempt(s): {str(e)}")
+                        raise e if isinstance(e, ModerationAPIError) else ModerationAPIError(str(e))
+                    delay = self._retry_delay(e, attempt)
+                    logger.warning(f"{self.name} call failed ({str(e)}), retrying in {delay:.2f}s")
+                    time.sleep(delay)
+                except Exception:
+                    # Errors that are not worth retrying still mean the API is unhealthy
+                    self.breaker.record_failure()
+                    raise
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            # A BaseException (KeyboardInterrupt, SystemExit) records nothing; without
+            # this the half-open circuit would wait for a trial that never ends
+            if is_trial:
+                self.breaker.release_trial()
+
+    def _retry_delay(self, error, attempt):
+        """
+        Exponential backoff with jitter, or the server's Retry-After when it sends
+        one, capped at the read timeout so a worker is never parked for minutes
+        """
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.timeout[1])
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+# One client per API and process, so connections are reused across calls
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_api_client(name, base_url=''):
+    """Return this process's shared client for the named API, configured from settings"""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = ModerationAPIClient(
+                name,
+                base_url=base_url,
+                timeout=getattr(settings, 'MODERATION_API_TIMEOUT', 10.0),
+                connect_timeout=getattr(settings, 'MODERATION_API_CONNECT_TIMEOUT', 3.05),
+                max_retries=getattr(settings, 'MODERATION_API_MAX_RETRIES', 2),
+                backoff=getattr(settings, 'MODERATION_API_BACKOFF', 0.5),
+                max_concurrency=getattr(settings, 'MODERATION_API_MAX_CONCURRENCY', 4),
+                rate_limit=getattr(settings, 'MODERATION_API_RATE_LIMIT', 0),
+                failure_threshold=getattr(settings, 'MODERATION_API_CIRCUIT_FAILURES', 5),
+                reset_timeout=getattr(settings, 'MODERATION_API_CIRCUIT_RESET', 30),
+            )
+        return _clients[name]
@@ -0,0 +1,202 @@
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import BlockedPost, ContentModerationStatus, Message, ModerationJob, PostImage, PostVideo, Profile
+
+logger = logging.getLogger(__name__)
+
+# content_type -> (model, media field, media kind)
+MODERATED_MEDIA = {
+    'post_image': (PostImage, 'image', 'image'),
+    'post_video': (PostVideo, 'video', 'video'),
+    'message_image': (Message, 'image', 'image'),
+    'message_video': (Message, 'video', 'video'),
+}
+
+
+class ModerationFailed(Exception):
+    """The moderation service could not produce a verdict"""
+
+
+def claim_jobs(worker_id, limit):
+    """
+    Claim up to `limit` due jobs for this worker. Each job is taken with a
+    conditional UPDATE, so concurrent workers never process the same job.
+    Every claim counts as an attempt. Jobs left running by a crashed worker
+    are reclaimed after MODERATION_JOB_TIMEOUT, or failed once they have used
+    up MODERATION_JOB_MAX_ATTEMPTS, so a job that kills its worker is not
+    retried forever.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.MODERATION_JOB_TIMEOUT)
+    stale = Q(status='running', locked_at__lt=stale_before)
+    _fail_exhausted_jobs(stale)
+
+    due = Q(status='queued', run_after__lte=now) | stale
+    claimed = []
+    for job_id in ModerationJob.objects.filter(due).order_by('run_after', 'id').values_list('id', flat=True)[:limit]:
+        taken = ModerationJob.objects.filter(due, id=job_id).update(
+            status='running',
+            attempts=F('attempts') + 1,
+            locked_by=worker_id,
+            locked_at=now
+        )
+        if taken:
+            claimed.append(job_id)
+    return claimed
+
+
+def release_jobs(job_ids, error):
+    """
+    Hand back jobs whose worker died before recording a verdict: they are
+    requeued with the usual delay, or failed once out of attempts
+    """
+    for job in ModerationJob.objects.select_related('moderation_status').filter(id__in=job_ids, status='running'):
+        logger.error(f"Moderation job {job.id} for {job.content_type} {job.content_id} was interrupted: {str(error)}")
+        _retry_or_fail_job(job, error)
+
+
+def _fail_exhausted_jobs(stale):
+    """Fail stale running jobs that have no attempts left"""
+    exhausted = ModerationJob.objects.select_related('moderation_status').filter(
+        stale, attempts__gte=settings.MODERATION_JOB_MAX_ATTEMPTS
+    )
+    error = f'Worker did not finish the job within {settings.MODERATION_JOB_TIMEOUT}s'
+    for job in exhausted:
+        # Another worker may have reclaimed or failed the job in the meantime
+        if ModerationJob.objects.filter(stale, id=job.id).update(status='failed', last_error=error, locked_by='', locked_at=None):
+            logger.error(f"Moderation job {job.id} for {job.content_type} {job.content_id} timed out {job.attempts} time(s), giving up")
+            _fail_job(job, error)
+
+
+def process_job(job_id):
+    """Run one claimed job to completion. Safe to call from a worker process."""
+    return process_jobs([job_id]).get(job_id)
+
+
+def process_jobs(job_ids):
+    """
+    Run claimed jobs to completion. All image jobs share one batched inference
+    call; videos are moderated one by one. Returns {job_id: status}.
+    """
+    # The backends pull in OpenCV, NumPy and the ML models, so they are only
+    # imported by processes that actually moderate, never by web workers
+    from .content_moderation import moderate_images_batch, moderate_video
+    
+    jobs = list(ModerationJob.objects.select_related('moderation_status').filter(id__in=job_ids))
+    image_jobs = []
+
+    for job in jobs:
+        model, field_name, media_kind = MODERATED_MEDIA[job.content_type]
+        instance = model.objects.filter(id=job.content_id).first()
+        media = getattr(instance, field_name, None) if instance else None
+        if not media:
+            # The upload was deleted before the worker reached it
+            _finish_job(job, 'done')
+        elif media_kind == 'image':
+            image_jobs.append((job, instance, media))
+        else:
+            try:
+                verdict = moderate_video(media)
+            except Exception as e:
+                verdict = (False, 0, {"error": str(e)})
+            _record_verdict(job, instance, verdict)
+
+    if image_jobs:
+        try:
+            verdicts = moderate_images_batch([media for _, _, media in image_jobs])
+        except Exception as e:
+            verdicts = [(False, 0, {"error": str(e)})] * len(image_jobs)
+        for (job, instance, _), verdict in zip(image_jobs, verdicts):
+            _record_verdict(job, instance, verdict)
+
+    return {job.id: job.status for job in jobs}
+
+
+def _record_verdict(job, instance, verdict):
+    is_safe, confidence, categories = verdict
+    try:
+        if isinstance(categories, dict) and 'error' in categories:
+            raise ModerationFailed(categories['error'])
+        apply_moderation_result(job, instance, is_safe, confidence, categories)
+        _finish_job(job, 'done')
+    except Exception as e:
+        logger.error(f"Error processing moderation job {job.id} for {job.content_type} {job.content_id}: {str(e)}")
+        _retry_or_fail_job(job, e)
+
+
+def apply_moderation_result(job, instance, is_safe, confidence, categories):
+    """Store the verdict on the moderation status row and the moderated content"""
+    moderation = job.moderation_status or ContentModerationStatus(content_type=job.content_type, content_id=job.content_id)
+    moderation.status = 'approved' if is_safe else 'rejected'
+    moderation.moderation_date = timezone.now()
+    moderation.rejection_reason = 'Inappropriate content detected' if not is_safe else None
+    moderation.moderation_data = categories
+    moderation.save()
+
+    # Update the flags with UPDATE queries so no post_save handlers run again
+    try:
+        if job.content_type in ('post_image', 'post_video'):
+            type(instance).objects.filter(id=instance.id).update(is_moderated=True, moderation_passed=is_safe)
+
+            # Block the whole post if its media failed moderation
+            if not is_safe:
+                post = instance.post
+                type(post).objects.filter(id=post.id).update(is_moderated=True, moderation_passed=False)
+                media_kind = 'image' if job.content_type == 'post_image' else 'video'
+                BlockedPost.objects.create(
+                    user=Profile.objects.filter(user__is_superuser=True).first(),
+                    post=post,
+                    reason=f"Automatic block: Inappropriate {media_kind} (score: {confidence})"
+                )
+                logger.warning(f"Post {post.id} blocked due to inappropriate {media_kind} content")
+        elif job.content_type == 'message_image':
+            Message.objects.filter(id=instance.id).update(is_image_moderated=True, image_moderation_passed=is_safe)
+            if not is_safe:
+                logger.warning(f"Message {instance.id} contained inappropriate image")
+        elif job.content_type == 'message_video':
+            Message.objects.filter(id=instance.id).update(is_video_moderated=True, video_moderation_passed=is_safe)
+            if not is_safe:
+                logger.warning(f"Message {instance.id} contained inappropriate video")
+    except Exception as e:
+        logger.error(f"Error updating moderation status: {str(e)}. Database may need migration.")
+
+
+def _finish_job(job, status):
+    job.status = status
+    job.locked_by = ''
+    job.locked_at = None
+    job.save(update_fields=['status', 'locked_by', 'locked_at', 'updated_at'])
+
+
+def _retry_or_fail_job(job, error):
+    """
+    Requeue the job with a growing delay, or record the error once attempts run
+    out. The attempt itself was counted when the job was claimed.
+    """
+    job.last_error = str(error)
+    if job.attempts < settings.MODERATION_JOB_MAX_ATTEMPTS:
+        job.run_after = timezone.now() + timedelta(seconds=settings.MODERATION_JOB_RETRY_DELAY * max(job.attempts, 1))
+        job.status = 'queued'
+    else:
+        job.status = 'failed'
+        _fail_job(job, error)
+
+    job.locked_by = ''
+    job.locked_at = None
+    job.save(update_fields=['last_error', 'run_after', 'status', 'locked_by', 'locked_at', 'updated_at'])
+
+
+def _fail_job(job, error):
+    """Mark the job's moderation status as errored so moderators can retry it"""
+    if job.moderation_status:
+        moderation = job.moderation_status
+        moderation.status = 'error'
+        moderation.moderation_date = timezone.now()
+        moderation.rejection_reason = str(error)[:50]
+        moderation.moderation_data = {"error": str(error)}
+        moderation.save()
@@ -0,0 +1,49 @@
+from django.db.models import prefetch_related_objects
+
+from .models import PostReaction, CommentReaction
+
+
+def attach_post_reactions(posts, profile):
+    """
+    Set post.user_reaction to the viewer's reaction (or None) on every post,
+    using a single query for the whole page. Returns the posts as a list.
+    """
+    posts = list(posts)
+    reactions = {
+        reaction.post_id: reaction
+        for reaction in PostReaction.objects.filter(user=profile, post__in=[post.id for post in posts])
+    }
+
+    for post in posts:
+        post.user_reaction = reactions.get(post.id)
+
+    return posts
+
+
+def attach_comment_reactions(comments, profile, include_replies=False):
+    """
+    Set comment.user_reaction and comment.user_has_reacted on every comment,
+    using a single query. With include_replies, the replies are resolved down
+    to the deepest level, prefetching 'replies' one query per level so the
+    recursive comment template reuses the annotated instances.
+    Returns the comments as a list.
+    """
+    comments = list(comments)
+    all_comments = list(comments)
+    if include_replies:
+        level = comments
+        while level:
+            prefetch_related_objects(level, 'replies', 'replies__author__user')
+            level = [reply for comment in level for reply in comment.replies.all()]
+            all_comments.extend(level)
+
+    reactions = {
+        reaction.comment_id: reaction
+        for reaction in CommentReaction.objects.filter(user=profile, comment__in=[comment.id for comment in all_comments])
+    }
+
+    for comment in all_comments:
+        comment.user_reaction = reactions.get(comment.id)
+        comment.user_has_reacted = comment.user_reaction is not None
+
+    return comments
@@ -0,0 +1,134 @@
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import ChatRoom, Message, RoomReadCursor
+
+# Seconds an unread-count summary is served from the cache
+UNREAD_COUNTS_CACHE_TIMEOUT = 60
+
+
+def _unread_counts_cache_key(profile_id):
+    return f'chat_unread_counts:{profile_id}'
+
+
+def mark_room_read(chat_room, profile):
+    """
+    Move the participant's read cursor up to the newest message in the room.
+    The newest message id and the cursor are read in one SELECT; when nothing
+    new arrived that is the only query. Otherwise the cursor only ever moves
+    forward with a conditional UPDATE (or an INSERT the first time), and in
+    one-on-one chats the other side's messages are flagged is_read.
+    Returns the id of the last message read.
+    """
+    latest = Message.objects.filter(room=OuterRef('pk')).order_by('-id').values('id')[:1]
+    last_read = RoomReadCursor.objects.filter(room=OuterRef('pk'), profile=profile).values('last_read_message_id')[:1]
+    latest_id, last_read_id = ChatRoom.objects.filter(pk=chat_room.pk).values_list(
+        Subquery(latest, output_field=IntegerField()),
+        Subquery(last_read, output_field=IntegerField())
+    ).first() or (None, None)
+    if latest_id is None:
+        return last_read_id or 0
+    if last_read_id is not None and last_read_id >= latest_id:
+        return last_read_id
+
+    if last_read_id is None:
+        cursor, created = RoomReadCursor.objects.get_or_create(
+            room=chat_room,
+            profile=profile,
+            defaults={'last_read_message_id': latest_id}
+        )
+        advanced = created or RoomReadCursor.objects.filter(
+            pk=cursor.pk, last_read_message_id__lt=latest_id
+        ).update(last_read_message_id=latest_id)
+    else:
+        advanced = RoomReadCursor.objects.filter(
+            room=chat_room,
+            profile=profile,
+            last_read_message_id__lt=latest_id
+        ).update(last_read_message_id=latest_id)
+    if not advanced:
+        # Another request moved the cursor first
+        return latest_id
+
+    # The global is_read flag is only meaningful in one-on-one chats
+    if not chat_room.is_group_chat:
+        Message.objects.filter(
+            room=chat_room,
+            is_read=False,
+            id__lte=latest_id
+        ).exclude(sender=profile).update(is_read=True)
+
+    cache.delete(_unread_counts_cache_key(profile.id))
+    return latest_id
+
+
+def annotate_unread_counts(rooms, profile):
+    """
+    Annotate a ChatRoom queryset with unread_message_count for the profile:
+    messages from other participants after the profile's read cursor.
+    """
+    last_read = RoomReadCursor.objects.filter(room=OuterRef('pk'), profile=profile).values('last_read_message_id')[:1]
+    return rooms.annotate(
+        last_read_message_id=Coalesce(Subquery(last_read, output_field=IntegerField()), 0)
+    ).annotate(
+        unread_message_count=Count(
+            'messages',
+            filter=Q(messages__id__gt=F('last_read_message_id')) & ~Q(messages__sender=profile)
+        )
+    )
+
+
+def get_unread_counts(profile):
+    """Return {room_id: unread count} for every room of the profile, cached per profile"""
+    cache_key = _unread_counts_cache_key(profile.id)
+    counts = cache.get(cache_key)
+    if counts is None:
+        rooms = annotate_unread_counts(ChatRoom.objects.filter(participants=profile), profile)
+        counts = dict(rooms.values_list('id', 'unread_message_count'))
+        cache.set(cache_key, counts, UNREAD_COUNTS_CACHE_TIMEOUT)
+    return counts
+
+
+def invalidate_unread_counts(profile_ids):
+    """Drop the cached unread counts of the given profiles"""
+    cache.delete_many([_unread_counts_cache_key(profile_id) for profile_id in profile_ids])
+
+
+@receiver(post_save, sender=Message)
+def invalidate_unread_counts_on_message(sender, instance, created, **kwargs):
+    """A new message changes the unread counts of everyone in the room but the sender"""
+    if created:
+        # .all() reuses participants prefetched by batched writes (see message_buffer)
+        invalidate_unread_counts(
+            [profile.id for profile in instance.room.participants.all() if profile.id != instance.sender_id]
+        )
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def start_read_cursors_for_new_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Members added to a room with history start reading at its newest message,
+    so the messages sent before they joined do not all show up as unread
+    """
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        pairs = [(room_id, instance.id) for room_id in pk_set]
+    else:
+        pairs = [(instance.id, profile_id) for profile_id in pk_set]
+
+    latest_ids = dict(
+        Message.objects.filter(room_id__in={room_id for room_id, _ in pairs})
+        .values('room_id').annotate(latest_id=Max('id')).values_list('room_id', 'latest_id')
+    )
+    cursors = [
+        RoomReadCursor(room_id=room_id, profile_id=profile_id, last_read_message_id=latest_ids[room_id])
+        for room_id, profile_id in pairs if room_id in latest_ids
+    ]
+    if cursors:
+        # A member who left and came back keeps their old cursor
+        RoomReadCursor.objects.bulk_create(cursors, ignore_conflicts=True)
+        invalidate_unread_counts({profile_id for _, profile_id in pairs})
@@ -0,0 +1,39 @@
+from django.db import connections, DEFAULT_DB_ALIAS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tables whose optional columns views need to know about
+TRACKED_TABLES = ['chat_post', 'chat_postimage', 'chat_postvideo', 'chat_message']
+
+# Process-wide cache of {alias: {table_name: set(column_names)}}
+_table_columns = {}
+
+def refresh_schema_capabilities(using=DEFAULT_DB_ALIAS):
+    """
+    Introspect the tracked tables once and cache their columns for this process.
+    Called after migrations; otherwise filled lazily on first use.
+    """
+    connection = connections[using]
+    columns = {}
+    try:
+        with connection.cursor() as cursor:
+            existing_tables = set(connection.introspection.table_names(cursor))
+            for table_name in TRACKED_TABLES:
+                if table_name in existing_tables:
+                    columns[table_name] = {
+                        column.name for column in connection.introspection.get_table_description(cursor, table_name)
+                    }
+    except Exception as e:
+        logger.warning(f"Could not introspect database schema: {str(e)}")
+        return columns
+
+    _table_columns[using] = columns
+    return columns
+
+def has_column(table_name, column_name, using=DEFAULT_DB_ALIAS):
+    """Return True if the column exists, without touching the database after the first call"""
+    columns = _table_columns.get(using)
+    if columns is None:
+        columns = refresh_schema_capabilities(using)
+    return column_name in columns.get(table_name, ())
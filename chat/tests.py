@@ -1,3 +1,899 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import cv2
+import numpy as np
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from . import content_moderation, schema
+from .consumers import ChatConsumer
+from .content_moderation import _image_array, _red_fraction, _run_prefilters, _sample_frames, moderate_video
+from .moderation_cache import lookup_verdicts, store_verdict
+from .moderation_client import ModerationAPIClient, ModerationAPIError
+from .moderation_queue import claim_jobs, release_jobs
+from .message_buffer import MessageWriteBuffer, write_messages
+from .models import (
+    ChatRoom, Comment, CommentReaction, ContentModerationStatus, Message, ModerationJob, Post, PostReaction, TimelineEntry,
+    backfill_timeline, enqueue_moderation, message_stream_payload,
+)
+from .reactions import attach_comment_reactions
+from .read_state import get_unread_counts, mark_room_read
+from .views import _get_feed_page, _get_message_window, message_stream
+
+
+def make_profile(username):
+    return User.objects.create_user(username, password='pw').profile
+
+
+class AttachCommentReactionsTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile('reader')
+        self.post = Post.objects.create(author=self.profile, content='post')
+
+    def test_nested_replies_are_annotated_at_every_depth(self):
+        top = Comment.objects.create(post=self.post, author=self.profile, content='top')
+        reply = Comment.objects.create(post=self.post, author=self.profile, content='reply', parent_comment=top)
+        nested = Comment.objects.create(post=self.post, author=self.profile, content='nested', parent_comment=reply)
+        CommentReaction.objects.create(comment=nested, user=self.profile)
+
+        comments = attach_comment_reactions(Comment.objects.filter(parent_comment=None), self.profile, include_replies=True)
+
+        reply = comments[0].replies.all()[0]
+        nested = reply.replies.all()[0]
+        self.assertFalse(reply.user_has_reacted)
+        self.assertTrue(nested.user_has_reacted)
+        # The replies are prefetched, so the template does not query per comment
+        with self.assertNumQueries(0):
+            self.assertEqual(list(nested.replies.all()), [])
+
+
+class CounterSignalTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile('author')
+        self.other = make_profile('friend')
+        self.post = Post.objects.create(author=self.profile, content='post')
+
+    def test_reactions_and_comments_keep_counters(self):
+        reaction = PostReaction.objects.create(post=self.post, user=self.other, reaction_type='love')
+        comment = Comment.objects.create(post=self.post, author=self.other, content='hi')
+        Comment.objects.create(post=self.post, author=self.profile, content='reply', parent_comment=comment)
+        CommentReaction.objects.create(comment=comment, user=self.profile)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.reaction_count, self.post.love_count, self.post.comment_count), (1, 1, 2))
+
+        reaction.delete()
+        # Deleting a comment uncounts its replies, but does not touch the deleted comment's reactions
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.reaction_count, self.post.love_count, self.post.comment_count), (0, 0, 0))
+
+    def test_deleting_a_post_skips_counter_updates(self):
+        for number in range(3):
+            comment = Comment.objects.create(post=self.post, author=self.other, content=f'comment {number}')
+            CommentReaction.objects.create(comment=comment, user=self.profile)
+        PostReaction.objects.create(post=self.post, user=self.other)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.post.delete()
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(updates, [])
+        self.assertFalse(Comment.objects.exists())
+
+    def test_reconcile_counters_repairs_drifted_counters(self):
+        comment = Comment.objects.create(post=self.post, author=self.other, content='hi')
+        PostReaction.objects.create(post=self.post, user=self.other, reaction_type='wow')
+        CommentReaction.objects.create(comment=comment, user=self.profile, reaction_type='sad')
+        # Writes that bypass the signals, e.g. raw SQL or bulk imports, leave counters stale
+        Post.objects.filter(id=self.post.id).update(reaction_count=9, wow_count=0, comment_count=0)
+        Comment.objects.filter(id=comment.id).update(reaction_count=0, sad_count=4)
+
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((self.post.reaction_count, self.post.wow_count, self.post.comment_count), (1, 1, 1))
+        self.assertEqual((comment.reaction_count, comment.sad_count, comment.like_count), (1, 1, 0))
+
+    def test_reaction_view_returns_the_counter(self):
+        self.client.force_login(self.other.user)
+        url = reverse('add_post_reaction', args=[self.post.id])
+        self.assertEqual(self.client.post(url, {'reaction_type': 'like'}).json()['count'], 1)
+        self.assertEqual(self.client.post(url, {'reaction_type': 'like'}).json()['count'], 0)
+
+
+class ReadStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = make_profile('alice')
+        self.bob = make_profile('bob')
+        self.room = ChatRoom.objects.create(name='group', is_group_chat=True)
+        self.room.participants.add(self.alice, self.bob)
+
+    def test_unread_counts_follow_the_read_cursor(self):
+        Message.objects.create(room=self.room, sender=self.bob, content='one')
+        Message.objects.create(room=self.room, sender=self.bob, content='two')
+        Message.objects.create(room=self.room, sender=self.alice, content='mine')
+        self.assertEqual(get_unread_counts(self.alice), {self.room.id: 2})
+
+        mark_room_read(self.room, self.alice)
+        self.assertEqual(get_unread_counts(self.alice), {self.room.id: 0})
+        Message.objects.create(room=self.room, sender=self.bob, content='three')
+        self.assertEqual(get_unread_counts(self.alice), {self.room.id: 1})
+
+    def test_marking_an_already_read_room_costs_one_query(self):
+        Message.objects.create(room=self.room, sender=self.bob, content='one')
+        latest_id = mark_room_read(self.room, self.alice)
+        with self.assertNumQueries(1):
+            self.assertEqual(mark_room_read(self.room, self.alice), latest_id)
+
+    def test_one_on_one_messages_are_flagged_read(self):
+        room = ChatRoom.objects.create()
+        room.participants.add(self.alice, self.bob)
+        theirs = Message.objects.create(room=room, sender=self.bob, content='hi')
+        mine = Message.objects.create(room=room, sender=self.alice, content='hello')
+        self.assertEqual(mark_room_read(room, self.alice), mine.id)
+        theirs.refresh_from_db()
+        mine.refresh_from_db()
+        self.assertEqual((theirs.is_read, mine.is_read), (True, False))
+
+    def test_cached_counts_are_dropped_when_a_message_arrives(self):
+        self.assertEqual(get_unread_counts(self.alice), {self.room.id: 0})
+        self.assertEqual(get_unread_counts(self.bob), {self.room.id: 0})
+        Message.objects.create(room=self.room, sender=self.bob, content='one')
+        self.assertEqual(get_unread_counts(self.alice), {self.room.id: 1})
+        # The sender's own counts did not change, so they stay cached
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_counts(self.bob), {self.room.id: 0})
+
+    def test_members_added_later_start_at_the_latest_message(self):
+        for number in range(3):
+            Message.objects.create(room=self.room, sender=self.bob, content=f'before {number}')
+        carol = make_profile('carol')
+        self.room.participants.add(carol)
+        self.assertEqual(get_unread_counts(carol), {self.room.id: 0})
+
+        Message.objects.create(room=self.room, sender=self.bob, content='after')
+        self.assertEqual(get_unread_counts(carol), {self.room.id: 1})
+
+        # Joining from the profile side works the same
+        dave = make_profile('dave')
+        dave.chat_rooms.add(self.room)
+        self.assertEqual(get_unread_counts(dave), {self.room.id: 0})
+
+
+@override_settings(CHAT_STREAM_HEARTBEAT_SECONDS=0.05, CHAT_STREAM_MAX_SECONDS=0.3)
+class MessageStreamTests(TestCase):
+    def setUp(self):
+        self.alice = make_profile('alice')
+        self.bob = make_profile('bob')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.alice, self.bob)
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.bob, content=f'message {number}')
+            for number in range(6)
+        ]
+
+    async def read_stream(self, last_event_id, on_open=None):
+        """Run the stream until it ends by itself; returns the message events"""
+        request = RequestFactory().get(f'/chat/{self.room.id}/stream/', HTTP_LAST_EVENT_ID=str(last_event_id))
+        request.user = self.alice.user
+        response = await message_stream(request, self.room.id)
+
+        events = []
+        async for chunk in response.streaming_content:
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if chunk.startswith('retry:') and on_open:
+                await on_open()
+            elif chunk.startswith('id:'):
+                events.append(json.loads(chunk.split('data: ', 1)[1]))
+        return events
+
+    @override_settings(CHAT_HISTORY_PAGE_SIZE=2)
+    async def test_resume_sends_every_missed_page_before_going_live(self):
+        events = await self.read_stream(self.messages[0].id)
+
+        sent_ids = [message['id'] for event in events for message in event['messages']]
+        self.assertEqual(sent_ids, [message.id for message in self.messages[1:]])
+        self.assertEqual([len(event['messages']) for event in events], [2, 2, 1])
+
+    async def test_live_events_already_replayed_are_skipped(self):
+        channel_layer = get_channel_layer()
+        replayed = await database_sync_to_async(message_stream_payload)(self.messages[5])
+
+        async def publish():
+            # The stream replayed message 5 already; only the newer one goes out
+            for message in (replayed, dict(replayed, id=replayed['id'] + 1)):
+                await channel_layer.group_send(f'chat_{self.room.id}', {'type': 'message_saved', 'message': message})
+
+        events = await self.read_stream(self.messages[3].id, on_open=publish)
+        sent_ids = [message['id'] for event in events for message in event['messages']]
+        self.assertEqual(sent_ids, [self.messages[4].id, self.messages[5].id, self.messages[5].id + 1])
+
+
+@override_settings(MODERATION_JOB_MAX_ATTEMPTS=2, MODERATION_JOB_TIMEOUT=600)
+class ModerationJobQueueTests(TestCase):
+    def setUp(self):
+        self.job = enqueue_moderation('post_image', 1)
+
+    def expire_lock(self):
+        ModerationJob.objects.filter(id=self.job.id).update(locked_at=timezone.now() - timedelta(seconds=601))
+
+    def test_claims_count_as_attempts_and_stale_jobs_give_up(self):
+        self.assertEqual(claim_jobs('worker-1', 10), [self.job.id])
+        self.assertEqual(claim_jobs('worker-2', 10), [])
+
+        # A worker that crashed mid-job leaves it running until the lock expires
+        self.expire_lock()
+        self.assertEqual(claim_jobs('worker-2', 10), [self.job.id])
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.attempts, self.job.locked_by), (2, 'worker-2'))
+
+        self.expire_lock()
+        self.assertEqual(claim_jobs('worker-3', 10), [])
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'failed')
+        self.assertEqual(self.job.moderation_status.status, 'error')
+
+    def test_released_jobs_are_requeued_until_attempts_run_out(self):
+        claim_jobs('worker-1', 10)
+        release_jobs([self.job.id], 'process died')
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ('queued', 1))
+        self.assertGreater(self.job.run_after, timezone.now())
+
+        ModerationJob.objects.filter(id=self.job.id).update(run_after=timezone.now())
+        claim_jobs('worker-1', 10)
+        release_jobs([self.job.id], 'process died')
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.last_error), ('failed', 'process died'))
+
+    def test_worker_survives_a_broken_process_pool(self):
+        broken_pool = mock.Mock()
+        broken_pool.map.side_effect = BrokenProcessPool('terminated abruptly')
+        fresh_pool = mock.Mock()
+        with mock.patch(
+            'chat.management.commands.run_moderation_worker._create_pool', side_effect=[broken_pool, fresh_pool]
+        ):
+            call_command('run_moderation_worker', '--once', '--processes=1', stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ('queued', 1))
+        broken_pool.shutdown.assert_called_once()
+        fresh_pool.shutdown.assert_called_once()
+
+    @override_settings(MODERATION_WARM_MODELS=False)
+    def test_worker_requeues_jobs_whose_processing_raises(self):
+        other = enqueue_moderation('post_image', 2)
+        stderr = io.StringIO()
+        with mock.patch(
+            'chat.management.commands.run_moderation_worker._process_jobs',
+            side_effect=[RuntimeError('database went away'), {other.id: 'done'}]
+        ):
+            call_command(
+                'run_moderation_worker', '--once', '--processes=0', '--batch-size=1',
+                stdout=io.StringIO(), stderr=stderr
+            )
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.last_error), ('queued', 'database went away'))
+        self.assertIn('Moderation batch failed: database went away', stderr.getvalue())
+
+    def test_pool_errors_requeue_the_claimed_jobs(self):
+        pool = mock.Mock()
+        pool.map.side_effect = RuntimeError('unpicklable result')
+        with mock.patch('chat.management.commands.run_moderation_worker._create_pool', return_value=pool):
+            call_command('run_moderation_worker', '--once', '--processes=1', stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ('queued', 1))
+        pool.shutdown.assert_called_once()
+
+
+def encode_image(array, image_format):
+    """Encode an RGB array as an in-memory upload"""
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, image_format)
+    buffer.seek(0)
+    return buffer
+
+
+class ImageDecodingTests(TestCase):
+    def test_formats_opencv_cannot_read_are_decoded_with_pillow(self):
+        rgb = np.zeros((40, 60, 3), np.uint8)
+        rgb[..., 1] = 200
+        upload = encode_image(rgb, 'GIF')
+        # opencv-python 4.8 builds have no GIF decoder
+        with mock.patch('chat.content_moderation.cv2.imdecode', return_value=None):
+            img = _image_array(upload)
+
+        self.assertEqual(img.shape, (40, 60, 3))
+        self.assertEqual(tuple(img[0, 0]), (0, 200, 0))
+        self.assertEqual(upload.tell(), 0)
+
+    def test_unreadable_input_decodes_to_none(self):
+        self.assertIsNone(_image_array(io.BytesIO(b'not an image')))
+        self.assertIsNone(_image_array('/nonexistent/image.jpg'))
+
+
+def block_image(seed):
+    """An RGB image of large random blocks, detailed enough for a perceptual hash"""
+    blocks = np.random.default_rng(seed).integers(0, 255, (8, 9), dtype=np.uint8)
+    gray = np.kron(blocks, np.ones((10, 10), np.uint8))
+    return np.dstack([gray, gray, gray])
+
+
+class VerdictCacheTests(TestCase):
+    def setUp(self):
+        caches[settings.MODERATION_VERDICT_CACHE].clear()
+
+    def reencoded_pair(self):
+        original = encode_image(block_image(1), 'PNG')
+        copy = io.BytesIO()
+        Image.open(original).save(copy, 'JPEG', quality=90)
+        original.seek(0)
+        copy.seek(0)
+        return original, copy
+
+    def test_perceptual_matches_only_return_rejections(self):
+        original, copy = self.reencoded_pair()
+        _, keys = lookup_verdicts('nudenet', [original])
+        store_verdict(keys[0], (True, 0.1, {'nudity': 0.1}))
+
+        verdicts, _ = lookup_verdicts('nudenet', [original, copy])
+        self.assertEqual(verdicts, [(True, 0.1, {'nudity': 0.1}), None])
+
+        store_verdict(keys[0], (False, 0.9, {'nudity': 0.9}))
+        verdicts, _ = lookup_verdicts('nudenet', [copy])
+        self.assertEqual(verdicts, [(False, 0.9, {'nudity': 0.9})])
+
+    def test_decoded_frames_are_not_cached(self):
+        frame = block_image(2)
+        verdicts, keys = lookup_verdicts('nudenet', [frame])
+        self.assertEqual((verdicts, keys), ([None], [None]))
+        store_verdict(keys[0], (False, 0.9, {'nudity': 0.9}))
+        self.assertEqual(lookup_verdicts('nudenet', [frame])[0], [None])
+
+
+@override_settings(MODERATION_CASCADE=['sanity', 'blood'], MODERATION_MIN_IMAGE_SIDE=32)
+class PrefilterTests(TestCase):
+    def test_only_images_tiny_in_both_dimensions_skip_the_backend(self):
+        self.assertEqual(_run_prefilters(np.zeros((20, 31, 3), np.uint8)), (True, 0, {'prefilter': 'too_small'}))
+        self.assertIsNone(_run_prefilters(np.zeros((31, 4000, 3), np.uint8)))
+        self.assertIsNone(_run_prefilters(np.zeros((4000, 31, 3), np.uint8)))
+
+    def test_red_images_go_to_the_backend_unless_a_reject_score_is_set(self):
+        red = np.zeros((200, 200, 3), np.uint8)
+        red[..., 2] = 180
+        self.assertIsNone(_run_prefilters(red))
+
+        with self.settings(MODERATION_CASCADE_BLOOD_REJECT_SCORE=1.0):
+            is_safe, score, categories = _run_prefilters(red)
+        self.assertFalse(is_safe)
+        self.assertEqual(categories['prefilter'], 'blood')
+
+
+class ModerationAPIClientTests(TestCase):
+    def test_retry_after_is_capped_at_the_read_timeout(self):
+        client = ModerationAPIClient('test', timeout=5)
+        response = mock.Mock(headers={'Retry-After': '3600'})
+        self.assertEqual(client._retry_delay(ModerationAPIError('busy', response=response), 0), 5)
+
+    def test_interrupted_trial_call_frees_the_half_open_circuit(self):
+        client = ModerationAPIClient('test', max_retries=0, failure_threshold=1, reset_timeout=0)
+        with self.assertRaises(ModerationAPIError):
+            client.call(mock.Mock(side_effect=ModerationAPIError('down')))
+
+        with self.assertRaises(KeyboardInterrupt):
+            client.call(mock.Mock(side_effect=KeyboardInterrupt))
+        self.assertEqual(client.call(lambda: 'ok'), 'ok')
+        self.assertEqual(client.breaker.state, 'closed')
+
+
+class MessageWriteBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = make_profile('alice')
+        self.bob = make_profile('bob')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.alice, self.bob)
+
+    def test_batch_write_sends_post_save_for_every_message(self):
+        get_unread_counts(self.alice)
+        messages = [Message(room=self.room, sender=self.bob, content=f'message {number}') for number in range(3)]
+        self.assertEqual(write_messages(messages), 3)
+        # The post_save receivers dropped the cached unread counts
+        self.assertEqual(get_unread_counts(self.alice), {self.room.id: 3})
+
+    def test_a_bad_row_does_not_lose_the_rest_of_the_batch(self):
+        messages = [
+            Message(room=self.room, sender=self.bob, content='first'),
+            Message(room=self.room, sender=self.bob, content=None),
+            Message(room=self.room, sender=self.bob, content='last'),
+        ]
+        self.assertEqual(write_messages(messages), 2)
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['first', 'last'])
+
+    async def test_buffer_flushes_when_full_and_keeps_arrival_order(self):
+        buffer = MessageWriteBuffer(max_size=2, interval=60)
+        for number in range(3):
+            buffer.add(self.room, self.bob, f'message {number}')
+        # Filling the buffer started a flush at once, without waiting for the timer
+        await asyncio.sleep(0)
+        self.assertEqual(buffer.pending, [])
+        self.assertIsNone(buffer.flush_handle)
+
+        # Waits for the running flush to finish
+        await buffer.flush()
+        contents = await database_sync_to_async(
+            lambda: list(Message.objects.order_by('id').values_list('content', flat=True))
+        )()
+        self.assertEqual(contents, ['message 0', 'message 1', 'message 2'])
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.alice = make_profile('alice')
+        self.bob = make_profile('bob')
+        self.carol = make_profile('carol')
+        self.alice.friends.add(self.bob)
+
+    def timeline(self, profile):
+        return set(TimelineEntry.objects.filter(owner=profile).values_list('post_id', flat=True))
+
+    def feed(self, profile):
+        return [post.id for post in _get_feed_page(profile)[0]]
+
+    def test_new_posts_fan_out_to_the_author_and_friends(self):
+        post = Post.objects.create(author=self.bob, content='hello')
+        self.assertEqual(self.timeline(self.bob), {post.id})
+        self.assertEqual(self.timeline(self.alice), {post.id})
+        self.assertEqual(self.timeline(self.carol), set())
+
+    @override_settings(TIMELINE_BACKFILL_LIMIT=3, TIMELINE_BACKFILL_BATCH=2)
+    def test_new_friends_get_the_newest_posts_up_to_the_limit(self):
+        posts = [Post.objects.create(author=self.carol, content=f'post {number}') for number in range(5)]
+        self.alice.friends.add(self.carol)
+        self.assertEqual(self.timeline(self.alice), {post.id for post in posts[2:]})
+        self.assertEqual(self.feed(self.alice), [post.id for post in reversed(posts[2:])])
+
+        # 0 copies the whole history, still batch by batch
+        backfill_timeline(self.bob, self.carol, limit=0)
+        self.assertEqual(self.timeline(self.bob), {post.id for post in posts})
+
+    def test_unfriending_removes_the_friend_posts_both_ways(self):
+        alice_post = Post.objects.create(author=self.alice, content='mine')
+        bob_post = Post.objects.create(author=self.bob, content='theirs')
+        self.alice.friends.remove(self.bob)
+        self.assertEqual(self.timeline(self.alice), {alice_post.id})
+        self.assertEqual(self.timeline(self.bob), {bob_post.id})
+
+    def test_clearing_friends_keeps_own_posts(self):
+        alice_post = Post.objects.create(author=self.alice, content='mine')
+        Post.objects.create(author=self.bob, content='theirs')
+        self.alice.friends.clear()
+        self.assertEqual(self.timeline(self.alice), {alice_post.id})
+
+    def test_blocking_a_friend_removes_and_hides_their_posts(self):
+        bob_post = Post.objects.create(author=self.bob, content='theirs')
+        self.client.force_login(self.alice.user)
+        self.client.post(reverse('block_user', args=[self.bob.user.username]))
+        self.assertNotIn(bob_post.id, self.timeline(self.alice))
+
+        # Entries that are still there (e.g. re-added later) are filtered on read
+        TimelineEntry.objects.create(owner=self.alice, post=bob_post, author=self.bob, created_at=bob_post.created_at)
+        self.assertEqual(self.feed(self.alice), [])
+
+    def test_posts_that_failed_moderation_are_only_shown_to_their_author(self):
+        post = Post.objects.create(author=self.bob, content='flagged')
+        Post.objects.filter(id=post.id).update(is_moderated=True, moderation_passed=False)
+        self.assertEqual(self.feed(self.alice), [])
+        self.assertEqual(self.feed(self.bob), [post.id])
+
+
+@override_settings(HOME_FEED_SIZE=2, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class FeedPaginationTests(TestCase):
+    def setUp(self):
+        self.alice = make_profile('alice')
+        self.client.force_login(self.alice.user)
+
+    def test_pages_neither_overlap_nor_skip_posts_with_equal_timestamps(self):
+        posts = [Post.objects.create(author=self.alice, content=f'post {number}') for number in range(5)]
+        # Three posts share a timestamp, so the page boundary falls inside the tie
+        tied = timezone.now()
+        for post in posts[1:4]:
+            TimelineEntry.objects.filter(post=post).update(created_at=tied)
+            Post.objects.filter(id=post.id).update(created_at=tied)
+        TimelineEntry.objects.filter(post=posts[4]).update(created_at=tied + timedelta(seconds=1))
+        Post.objects.filter(id=posts[4].id).update(created_at=tied + timedelta(seconds=1))
+
+        response = self.client.get(reverse('home'))
+        seen = [post.id for post in response.context['posts']]
+        next_page_url = response.context['next_page_url']
+        while next_page_url:
+            response = self.client.get(next_page_url)
+            seen += [post.id for post in response.context['posts']]
+            next_page_url = response.context['next_page_url']
+
+        expected = [posts[4].id, posts[3].id, posts[2].id, posts[1].id, posts[0].id]
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursors_are_rejected(self):
+        url = reverse('home_feed_page')
+        self.assertEqual(self.client.get(url, {'before': '2024-02-30T00:00:00', 'before_id': '1'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'before': 'yesterday', 'before_id': '1'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'before': '2024-02-01T00:00:00', 'before_id': 'x'}).status_code, 400)
+
+
+class SchemaCapabilityTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(schema._table_columns, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_columns_are_introspected_once_per_process(self):
+        self.assertTrue(schema.has_column('chat_post', 'is_moderated'))
+        with self.assertNumQueries(0):
+            self.assertTrue(schema.has_column('chat_message', 'is_image_moderated'))
+            self.assertFalse(schema.has_column('chat_post', 'no_such_column'))
+            self.assertFalse(schema.has_column('chat_untracked', 'id'))
+
+    def test_failed_introspection_is_retried(self):
+        with mock.patch.object(connection.introspection, 'table_names', side_effect=Exception('no database')):
+            self.assertFalse(schema.has_column('chat_post', 'is_moderated'))
+        self.assertTrue(schema.has_column('chat_post', 'is_moderated'))
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=2)
+class MessageWindowTests(TestCase):
+    def setUp(self):
+        self.alice = make_profile('alice')
+        self.bob = make_profile('bob')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.alice, self.bob)
+
+    def test_windows_walk_back_through_the_whole_history(self):
+        messages = [Message.objects.create(room=self.room, sender=self.bob, content=f'm{number}') for number in range(5)]
+        window, older_url = _get_message_window(self.room)
+        seen = [[message.id for message in window]]
+        while older_url:
+            before_id = int(older_url.split('before=')[1])
+            window, older_url = _get_message_window(self.room, before_id=before_id)
+            seen.insert(0, [message.id for message in window])
+
+        ids = [message.id for message in messages]
+        self.assertEqual(seen, [ids[:1], ids[1:3], ids[3:]])
+
+    def test_older_messages_endpoint_checks_access_and_cursor(self):
+        url = reverse('get_older_messages', args=[self.room.id])
+        self.client.force_login(make_profile('mallory').user)
+        self.assertEqual(self.client.get(url, {'before': '10'}).status_code, 403)
+        self.client.force_login(self.alice.user)
+        self.assertEqual(self.client.get(url, {'before': 'latest'}).status_code, 400)
+
+
+def local_redis_url():
+    """REDIS_URL, or the default local Redis, when a server answers there"""
+    url = os.environ.get('REDIS_URL') or 'redis://127.0.0.1:6379'
+    try:
+        import redis
+        redis.Redis.from_url(url, socket_connect_timeout=0.2).ping()
+    except Exception:
+        return None
+    return url
+
+
+class ChannelLayerCheckTests(TestCase):
+    def check_layer(self):
+        stdout = io.StringIO()
+        call_command('check_channel_layer', listeners=3, messages=20, timeout=5, stdout=stdout)
+        return stdout.getvalue()
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_round_trip_through_the_memory_layer(self):
+        output = self.check_layer()
+        self.assertIn('Delivered 60/60 messages', output)
+        self.assertIn('Channel layer OK', output)
+
+    @skipUnless(local_redis_url(), 'no Redis server to test against')
+    def test_round_trip_through_redis(self):
+        layers = {'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [local_redis_url()], 'prefix': 'test-layer-check'},
+        }}
+        with self.settings(CHANNEL_LAYERS=layers):
+            self.assertIn('Delivered 60/60 messages', self.check_layer())
+
+    @override_settings(CHANNEL_LAYERS={})
+    def test_missing_layer_is_reported(self):
+        with self.assertRaisesMessage(CommandError, 'No channel layer is configured'):
+            self.check_layer()
+
+
+class ModelRegistryTests(TestCase):
+    def setUp(self):
+        self.loader = mock.Mock(side_effect=lambda: object())
+        patches = [
+            mock.patch.dict(content_moderation.MODEL_LOADERS, {'fake': self.loader}),
+            mock.patch.dict(content_moderation.SERVICE_MODELS, {'fake': ['fake']}),
+            mock.patch.object(content_moderation, '_loaded_models', {}),
+            mock.patch.object(content_moderation, '_model_stats', {}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_models_load_once_per_process(self):
+        first = content_moderation.get_moderation_model('fake')
+        self.assertIs(content_moderation.get_moderation_model('fake'), first)
+        self.loader.assert_called_once()
+
+        stats = content_moderation.warm_moderation_models('fake')
+        self.loader.assert_called_once()
+        self.assertEqual(stats['fake']['pid'], os.getpid())
+
+    def test_concurrent_first_use_loads_once(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            models = list(executor.map(lambda _: content_moderation.get_moderation_model('fake'), range(16)))
+        self.loader.assert_called_once()
+        self.assertEqual(len({id(model) for model in models}), 1)
+
+    def test_failed_warm_up_is_retried_on_next_use(self):
+        self.loader.side_effect = [OSError('weights download failed'), object()]
+        self.assertEqual(content_moderation.warm_moderation_models('fake'), {})
+        self.assertIsNotNone(content_moderation.get_moderation_model('fake'))
+        self.assertEqual(self.loader.call_count, 2)
+
+
+class VideoSamplingTests(TestCase):
+    def setUp(self):
+        caches[settings.MODERATION_VERDICT_CACHE].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'clip.avi')
+        # 3.5 seconds at 10 fps; each frame's brightness encodes its index
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (32, 24))
+        for index in range(35):
+            writer.write(np.full((24, 32, 3), index * 7, np.uint8))
+        writer.release()
+
+    def test_frames_are_sampled_in_one_pass_without_seeking(self):
+        seeks = []
+
+        open_capture = cv2.VideoCapture
+
+        class RecordingCapture:
+            def __init__(self, source):
+                self.capture = open_capture(source)
+
+            def set(self, prop, value):
+                seeks.append((prop, value))
+                return self.capture.set(prop, value)
+
+            def __getattr__(self, name):
+                return getattr(self.capture, name)
+
+        with mock.patch('chat.content_moderation.cv2.VideoCapture', RecordingCapture):
+            frames = _sample_frames(self.path, max_frames=10)
+
+        self.assertEqual(seeks, [])
+        # One frame per second: indices 0, 11 and 23
+        self.assertEqual([round(float(frame.mean()) / 7) for frame in frames], [0, 11, 23])
+
+    @override_settings(MODERATION_VIDEO_MAX_FRAMES=2)
+    def test_sampled_frames_are_moderated_as_one_batch(self):
+        verdicts = [(True, 0.9, {'nudity': 0.1}), (False, 0.7, {'nudity': 0.8})]
+        with mock.patch('chat.content_moderation.moderate_images_batch', return_value=verdicts) as batch:
+            self.assertEqual(moderate_video(self.path), (False, 0.7, {'nudity': 0.8}))
+        self.assertEqual(len(batch.call_args.args[0]), 2)
+
+    def test_video_verdicts_are_cached_by_file_hash(self):
+        verdicts = [(False, 0.7, {'nudity': 0.8})]
+        with mock.patch('chat.content_moderation.moderate_images_batch', return_value=verdicts) as batch:
+            self.assertEqual(moderate_video(self.path), (False, 0.7, {'nudity': 0.8}))
+            # The same bytes uploaded again are answered from the cache
+            with open(self.path, 'rb') as upload:
+                self.assertEqual(moderate_video(upload), (False, 0.7, {'nudity': 0.8}))
+        batch.assert_called_once()
+
+        with mock.patch('chat.content_moderation.moderate_images_batch', return_value=verdicts) as batch:
+            with override_settings(CONTENT_MODERATION_SERVICE='tensorflow'):
+                moderate_video(self.path)
+        batch.assert_called_once()
+
+    def test_video_without_decodable_frames_is_an_error(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a video')
+        with mock.patch('chat.content_moderation.moderate_images_batch') as batch:
+            self.assertEqual(moderate_video(self.path), (False, 0, {'error': 'Unable to decode video frames'}))
+            # Errors are never cached, so the next attempt decodes again
+            with mock.patch('chat.content_moderation._sample_frames', return_value=[]) as sample:
+                moderate_video(self.path)
+            sample.assert_called_once()
+        batch.assert_not_called()
+
+
+class BloodColourTests(TestCase):
+    def test_red_fraction_matches_opencv_hsv_in_range(self):
+        # Every 8-bit BGR colour once, so any rounding difference would show
+        levels = np.arange(256, dtype=np.uint8)
+        img = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(4096, 4096, 3)
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        mask = cv2.bitwise_or(
+            cv2.inRange(hsv, np.array([0, 60, 60]), np.array([10, 255, 255])),
+            cv2.inRange(hsv, np.array([160, 60, 60]), np.array([180, 255, 255]))
+        )
+        self.assertEqual(_red_fraction(img), cv2.countNonZero(mask) / mask.size)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_benchmark_runs_against_the_stub_api(self):
+        stdout = io.StringIO()
+        call_command(
+            'benchmark_moderation', '--images=4', '--videos=1', '--width=64', '--height=48',
+            '--video-seconds=1', '--batch-size=2', '--stub-latency=0', stdout=stdout
+        )
+        output = stdout.getvalue()
+        self.assertIn('Generated 4 image(s) and 1 video(s) at 64x48', output)
+        for name in ('detect_blood_in_image', 'moderate_image', 'moderate_video'):
+            self.assertRegex(output, rf'{name}: p50 .* 0 error\(s\)')
+        self.assertIn('moderate_images_batch:', output)
+
+    def test_unknown_backends_are_rejected(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown backend(s): rekognition'):
+            call_command('benchmark_moderation', '--backends=rekognition', stdout=io.StringIO())
+
+
+@override_settings(MODERATION_DASHBOARD_PAGE_SIZE=2, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ModerationDashboardTests(TestCase):
+    def setUp(self):
+        User.objects.create_user('moderator', password='pw', is_staff=True)
+        self.client.login(username='moderator', password='pw')
+        author = make_profile('author')
+        post = Post.objects.create(author=author, content='post')
+        self.pending = [
+            ContentModerationStatus.objects.create(
+                content_type='comment',
+                content_id=Comment.objects.create(post=post, author=author, content=f'comment {number}').id
+            )
+            for number in range(5)
+        ]
+        for _ in range(2):
+            ContentModerationStatus.objects.create(content_type='comment', content_id=0, status='approved')
+        ContentModerationStatus.objects.create(content_type='post_image', content_id=0, status='rejected')
+
+    def test_pages_follow_the_id_keyset(self):
+        url = reverse('moderation_dashboard')
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append([item.id for item in response.context['items']])
+            url = response.context['next_page_url']
+
+        ids = [moderation.id for moderation in reversed(self.pending)]
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+        self.assertEqual(response.context['items'][0].content_object.content, 'comment 0')
+
+    def test_tab_counts_come_from_one_grouped_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('moderation_dashboard'), {'status': 'approved'})
+        counts = {tab['status']: tab['count'] for tab in response.context['tabs']}
+        self.assertEqual(counts, {'pending': 5, 'approved': 2, 'rejected': 1, 'error': 0})
+        self.assertEqual(sum('COUNT(' in query['sql'] for query in queries.captured_queries), 1)
+
+        response = self.client.get(reverse('moderation_dashboard'), {'content_type': 'post_image'})
+        counts = {tab['status']: tab['count'] for tab in response.context['tabs']}
+        self.assertEqual(counts, {'pending': 0, 'approved': 0, 'rejected': 1, 'error': 0})
+        self.assertIn('content_type=post_image', response.context['tabs'][2]['url'])
+
+    def test_dashboard_is_staff_only(self):
+        self.client.logout()
+        make_profile('member')
+        self.client.login(username='member', password='pw')
+        self.assertEqual(self.client.get(reverse('moderation_dashboard')).status_code, 302)
+
+
+class StartupImportTests(TestCase):
+    def test_web_entry_points_do_not_load_moderation_backends(self):
+        stdout = io.StringIO()
+        # Timing depends on the machine; the forbidden module check is what matters here
+        call_command('check_import_time', '--budget-ms=60000', stdout=stdout)
+        self.assertIn('Startup imports within budget', stdout.getvalue())
+
+    def test_loading_a_backend_fails_the_check(self):
+        with self.assertRaisesMessage(CommandError, 'heavy modules loaded at startup: cv2'):
+            call_command('check_import_time', '--budget-ms=60000', 'chat.moderation_queue', 'chat.content_moderation', stdout=io.StringIO())
+
+
+@override_settings(CHAT_WRITE_BUFFER_ENABLED=False)
+class ChatConsumerTests(TestCase):
+    def setUp(self):
+        self.alice = make_profile('alice')
+        self.bob = make_profile('bob')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.alice, self.bob)
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'room_id': str(self.room.id)}}
+        return communicator
+
+    async def test_participants_connect(self):
+        communicator = self.communicator(self.alice.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['message'], 'alice joined the chat')
+        await communicator.disconnect()
+
+    async def test_non_participants_and_anonymous_users_are_rejected(self):
+        outsider = await database_sync_to_async(make_profile)('mallory')
+        for user in (outsider.user, AnonymousUser()):
+            connected, _ = await self.communicator(user).connect()
+            self.assertFalse(connected)
+
+    def save_messages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(3):
+                Message.objects.create(room=self.room, sender=self.bob, content=f'message {number}')
+            try:
+                with transaction.atomic():
+                    Message.objects.create(room=self.room, sender=self.bob, content='rolled back')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        return list(Message.objects.order_by('id').values_list('id', flat=True))
+
+    async def test_committed_messages_arrive_once_in_order(self):
+        communicators = [self.communicator(self.alice.user), self.communicator(self.bob.user)]
+        for communicator in communicators:
+            await communicator.connect()
+        # Drop the join notices
+        await asyncio.sleep(0.05)
+        for communicator in communicators:
+            while not communicator.output_queue.empty():
+                communicator.output_queue.get_nowait()
+
+        saved_ids = await database_sync_to_async(self.save_messages)()
+        self.assertEqual(len(saved_ids), 3)
+        for communicator in communicators:
+            frames = [await communicator.receive_json_from() for _ in saved_ids]
+            self.assertEqual([frame['id'] for frame in frames], saved_ids)
+            self.assertEqual([frame['seq'] for frame in frames], [1, 2, 3])
+            self.assertEqual(frames[0]['message'], 'message 0')
+            # Neither a duplicate nor the rolled-back message follows
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+    def test_saving_a_message_is_a_single_insert(self):
+        consumer = ChatConsumer()
+        consumer.user = self.alice.user
+        consumer.room_id = str(self.room.id)
+        # Profile, room and its participants, once per connection
+        with self.assertNumQueries(3):
+            consumer.profile, consumer.room = async_to_sync(consumer.get_room_access)()
+
+        # The unread-count invalidation reuses the prefetched participants
+        for number in range(3):
+            with CaptureQueriesContext(connection) as queries:
+                async_to_sync(consumer.save_message)(f'message {number}')
+            self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries], ['INSERT'])
@@ -3,17 +3,20 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('feed/more/', views.home_feed_page, name='home_feed_page'),
     path('signup/', views.signup, name='signup'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('profile/<str:username>/', views.profile_detail, name='profile_detail'),
     path('profile/<str:username>/friend-request/', views.send_friend_request, name='send_friend_request'),
     path('friend-request/<int:request_id>/<str:action>/', views.respond_friend_request, name='respond_friend_request'),
     path('chats/', views.chat_list, name='chat_list'),
+    path('chats/unread/', views.get_unread_counts_view, name='get_unread_counts'),
     path('chat/create/<str:username>/', views.create_or_get_direct_chat, name='create_or_get_direct_chat'),
     path('chat/<int:room_id>/', views.chat_room, name='chat_room'),
     path('chat/<int:room_id>/send/', views.send_message, name='send_message'),
     path('chat/<int:room_id>/messages/', views.get_messages, name='get_messages'),
     path('chat/<int:room_id>/messages/htmx/', views.get_chat_messages, name='get_chat_messages'),
+    path('chat/<int:room_id>/messages/older/', views.get_older_messages, name='get_older_messages'),
     path('friends/', views.friends_list, name='friends_list'),
     path('search/', views.search_users, name='search_users'),
     path('post/<int:post_id>/delete/', views.delete_post, name='delete_post'),
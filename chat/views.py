@@ -1,34 +1,40 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from django.http import JsonResponse, StreamingHttpResponse, HttpResponseForbidden, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse, HttpResponseForbidden, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
-import json, asyncio, time
+import json, asyncio
 from datetime import datetime
 from channels.db import database_sync_to_async
 
-from chat.content_moderation import moderate_image, moderate_video
-from .models import Notification, Profile, FriendRequest, Post, ChatRoom, Message, BlockedPost, PostReaction, Comment, CommentReaction, PostShare, Repost, FriendList, MessageReaction, VoiceCall, PostImage, PostVideo, ContentModerationStatus
+from .models import message_stream_payload, Notification, Profile, FriendRequest, Post, ChatRoom, Message, BlockedPost, PostReaction, Comment, CommentReaction, PostShare, Repost, FriendList, MessageReaction, VoiceCall, PostImage, PostVideo, ContentModerationStatus, ModerationJob, TimelineEntry
 from .forms import ProfileForm, PostForm
+from .moderation_queue import MODERATED_MEDIA
+from .reactions import attach_post_reactions, attach_comment_reactions
+from .read_state import mark_room_read, get_unread_counts
+from .schema import has_column
 from django.db.models.functions import Now
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.db.backends.signals import connection_created
 from django.db.utils import OperationalError
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.template.loader import render_to_string
 from django.middleware.csrf import get_token
 from django.db.utils import IntegrityError
 from django.urls import reverse
 from django.views.decorators.http import require_POST
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+from django.conf import settings
 import pytz
 import logging
 from django.db.models import F
 from django.db.models.functions import Concat
-from django.db import connection
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
@@ -68,66 +74,6 @@ def home(request):
     user_profile = request.user.profile
     form = PostForm()
     
-    # Get friend IDs to filter posts
-    friends = user_profile.friends.all()
-    friend_ids = [friend.id for friend in friends]
-    
-    # Get blocked users
-    blocked_user_ids = user_profile.blocked_users.values_list('id', flat=True)
-    blocked_by_ids = user_profile.blocked_by.values_list('id', flat=True)
-    all_blocked_ids = list(blocked_user_ids) + list(blocked_by_ids)
-    
-    # Query posts from the user and their friends, excluding blocked users and failed moderation
-    posts = Post.objects.filter(
-        Q(author=user_profile) | Q(author__in=friends)
-    ).exclude(
-        author__in=all_blocked_ids
-    )
-    
-    # Try to filter by moderation status, but don't break if fields don't exist
-    try:
-        # Check if moderation fields exist before filtering
-        with connection.cursor() as cursor:
-            # For PostgreSQL (Render.com)
-            try:
-                cursor.execute("""
-                    SELECT column_name FROM information_schema.columns 
-                    WHERE table_name = 'chat_post' AND column_name = 'is_moderated'
-                """)
-                has_moderation = bool(cursor.fetchone())
-            except:
-                # For SQLite (local development)
-                try:
-                    cursor.execute("PRAGMA table_info(chat_post)")
-                    columns = [info[1] for info in cursor.fetchall()]
-                    has_moderation = 'is_moderated' in columns
-                except:
-                    has_moderation = False
-                    
-        if has_moderation:
-            posts = posts.exclude(
-                # Exclude posts that failed moderation (unless they belong to the current user)
-                ~Q(author=user_profile) & Q(is_moderated=True) & Q(moderation_passed=False)
-            )
-        else:
-            logger.warning("Moderation fields don't exist yet, skipping moderation filtering")
-            
-    except Exception as e:
-        logger.warning(f"Could not filter posts by moderation status: {str(e)}. Database may need migration.")
-    
-    # Select related fields and order by created_at
-    posts = posts.select_related('author', 'author__user').prefetch_related(
-        'comments', 'comments__author', 'comments__author__user',
-        'post_shares', 'reactions', 'repost_of', 'repost_of__original_post',
-        'images', 'videos'  # Added prefetch for images and videos
-    ).order_by('-created_at')
-    
-    # Check user reactions for each post
-    for post in posts:
-        post.user_reaction = PostReaction.objects.filter(post=post, user=user_profile).first()
-        for comment in post.comments.all():
-            comment.user_reaction = CommentReaction.objects.filter(comment=comment, user=user_profile).first()
-    
     # Process post creation form
     if request.method == 'POST':
         form = PostForm(request.POST, request.FILES)
@@ -150,12 +96,89 @@ def home(request):
             messages.success(request, "Post created successfully! Media files will be reviewed for appropriate content.")
             return redirect('home')
     
+    posts, next_page_url = _get_feed_page(user_profile)
+    
     return render(request, 'chat/home.html', {
         'form': form,
         'posts': posts,
+        'next_page_url': next_page_url,
         'friend_requests': FriendRequest.objects.filter(to_user=user_profile, status='pending'),
     })
 
+@login_required
+def home_feed_page(request):
+    """Return the next page of the home feed for infinite scroll"""
+    try:
+        # parse_datetime raises ValueError for well-formed but impossible dates
+        before = parse_datetime(request.GET.get('before', ''))
+        before_id = int(request.GET.get('before_id', ''))
+    except ValueError:
+        before = before_id = None
+    
+    if before is None or before_id is None:
+        return HttpResponseBadRequest("A valid 'before' and 'before_id' cursor is required")
+    
+    posts, next_page_url = _get_feed_page(request.user.profile, before=before, before_id=before_id)
+    
+    return render(request, 'chat/includes/feed_posts.html', {
+        'posts': posts,
+        'next_page_url': next_page_url,
+    })
+
+def _get_feed_page(user_profile, before=None, before_id=None):
+    """
+    Read one page of the user's timeline, keyset-paginated on (created_at, id).
+    Returns a tuple (posts, next_page_url)
+    """
+    # Get blocked users
+    blocked_user_ids = user_profile.blocked_users.values_list('id', flat=True)
+    blocked_by_ids = user_profile.blocked_by.values_list('id', flat=True)
+    all_blocked_ids = list(blocked_user_ids) + list(blocked_by_ids)
+    
+    # Read the user's precomputed timeline, excluding blocked users and failed moderation
+    entries = TimelineEntry.objects.filter(owner=user_profile).exclude(
+        author__in=all_blocked_ids
+    )
+    
+    # Filter by moderation status, but don't break if the fields don't exist yet
+    if has_column('chat_post', 'is_moderated'):
+        entries = entries.exclude(
+            # Exclude posts that failed moderation (unless they belong to the current user)
+            ~Q(author=user_profile) & Q(post__is_moderated=True) & Q(post__moderation_passed=False)
+        )
+    else:
+        logger.warning("Moderation fields don't exist yet, skipping moderation filtering")
+    
+    # Continue after the last post of the previous page
+    if before is not None:
+        entries = entries.filter(
+            Q(created_at__lt=before) | Q(created_at=before, post_id__lt=before_id)
+        )
+    
+    # Take a bounded, pre-sorted slice of the timeline, plus one row to detect a next page
+    feed_size = getattr(settings, 'HOME_FEED_SIZE', 50)
+    page = list(entries.order_by('-created_at', '-post_id').values_list('post_id', 'created_at')[:feed_size + 1])
+    has_next_page = len(page) > feed_size
+    page = page[:feed_size]
+    
+    # Select related fields and order by created_at
+    posts = Post.objects.filter(id__in=[post_id for post_id, _ in page]).select_related('author', 'author__user').prefetch_related(
+        'comments', 'comments__author', 'comments__author__user',
+        'post_shares', 'repost_of', 'repost_of__original_post',
+        'images', 'videos'  # Added prefetch for images and videos
+    ).order_by('-created_at', '-id')
+    
+    # Resolve the viewer's reactions for the whole page at once
+    posts = attach_post_reactions(posts, user_profile)
+    attach_comment_reactions([comment for post in posts for comment in post.comments.all()], user_profile)
+    
+    next_page_url = None
+    if has_next_page:
+        last_post_id, last_created_at = page[-1]
+        next_page_url = f"{reverse('home_feed_page')}?{urlencode({'before': last_created_at.isoformat(), 'before_id': last_post_id})}"
+    
+    return posts, next_page_url
+
 @login_required
 def profile_detail(request, username):
     user = get_object_or_404(User, username=username)
@@ -258,13 +281,26 @@ def respond_friend_request(request, request_id, action):
 @login_required
 def chat_list(request):
     user_profile = request.user.profile
-    chat_rooms = ChatRoom.objects.filter(participants=user_profile)
+    chat_rooms = ChatRoom.objects.filter(participants=user_profile).prefetch_related('participants__user')
+    unread_counts = get_unread_counts(user_profile)
+    
+    for chat_room in chat_rooms:
+        chat_room.unread_message_count = unread_counts.get(chat_room.id, 0)
     
     context = {
         'chat_rooms': chat_rooms
     }
     return render(request, 'chat/chat_list.html', context)
 
+@login_required
+def get_unread_counts_view(request):
+    """Return unread message counts per chat room for badge polling"""
+    unread_counts = get_unread_counts(request.user.profile)
+    return JsonResponse({
+        'rooms': {str(room_id): count for room_id, count in unread_counts.items()},
+        'total': sum(unread_counts.values())
+    })
+
 @login_required
 def create_or_get_direct_chat(request, username):
     other_user = get_object_or_404(User, username=username)
@@ -303,17 +339,11 @@ def chat_room(request, room_id):
         messages.error(request, "You cannot access this chat room.")
         return redirect('chat_list')
     
-    # Get messages
-    messages_list = Message.objects.filter(room=chat_room).order_by('timestamp')
+    # Get the most recent window of messages
+    messages_list, older_messages_url = _get_message_window(chat_room)
     
     # Mark unread messages as read
-    unread_messages = messages_list.filter(
-        is_read=False
-    ).exclude(sender=user_profile)
-    
-    for msg in unread_messages:
-        msg.is_read = True
-        msg.save()
+    mark_room_read(chat_room, user_profile)
     
     # Get other participants
     other_participants = chat_room.participants.exclude(id=user_profile.id)
@@ -321,6 +351,7 @@ def chat_room(request, room_id):
     context = {
         'chat_room': chat_room,
         'messages': messages_list,
+        'older_messages_url': older_messages_url,
         'user_profile': user_profile,
         'other_participants': other_participants,
     }
@@ -452,21 +483,16 @@ def get_messages(request, room_id):
     if not chat_room.participants.filter(id=user_profile.id).exists():
         return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
     
-    # Get messages
-    messages_list = Message.objects.filter(room=chat_room).order_by('timestamp')
+    # Get the most recent window of messages
+    messages_list, older_messages_url = _get_message_window(chat_room)
     
     # Mark unread messages as read
-    unread_messages = messages_list.filter(
-        is_read=False
-    ).exclude(sender=user_profile)
-    
-    for msg in unread_messages:
-        msg.is_read = True
-        msg.save()
+    mark_room_read(chat_room, user_profile)
     
     # Render messages template
     messages_html = render_to_string('chat/messages.html', {
         'messages': messages_list,
+        'older_messages_url': older_messages_url,
         'user_profile': user_profile
     }, request=request)
     
@@ -485,24 +511,68 @@ def get_chat_messages(request, room_id):
     if not chat_room.participants.filter(id=user_profile.id).exists():
         return HttpResponseForbidden("Access denied")
     
-    # Get messages
-    messages_list = Message.objects.filter(room=chat_room).order_by('timestamp')
+    # Get the most recent window of messages
+    messages_list, older_messages_url = _get_message_window(chat_room)
     
     # Mark unread messages as read
-    unread_messages = messages_list.filter(
-        is_read=False
-    ).exclude(sender=user_profile)
-    
-    for msg in unread_messages:
-        msg.is_read = True
-        msg.save()
+    mark_room_read(chat_room, user_profile)
     
     # Render messages template for HTMX
     return render(request, 'chat/messages.html', {
         'messages': messages_list,
+        'older_messages_url': older_messages_url,
+        'request': request
+    })
+
+@login_required
+def get_older_messages(request, room_id):
+    """Get the window of messages sent before a given message id"""
+    chat_room = get_object_or_404(ChatRoom, id=room_id)
+    user_profile = request.user.profile
+    
+    # Check if user is participant
+    if not chat_room.participants.filter(id=user_profile.id).exists():
+        return HttpResponseForbidden("Access denied")
+    
+    try:
+        before_id = int(request.GET.get('before', ''))
+    except ValueError:
+        return HttpResponseBadRequest("A valid 'before' message id is required")
+    
+    messages_list, older_messages_url = _get_message_window(chat_room, before_id=before_id)
+    
+    return render(request, 'chat/messages.html', {
+        'messages': messages_list,
+        'older_messages_url': older_messages_url,
         'request': request
     })
 
+def _get_message_window(chat_room, before_id=None):
+    """
+    Read the latest CHAT_HISTORY_PAGE_SIZE messages of a room (or those before
+    before_id), keyset-paginated on the message id.
+    Returns a tuple (messages in chronological order, older_messages_url)
+    """
+    page_size = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+    
+    window = Message.objects.filter(room=chat_room)
+    if before_id is not None:
+        window = window.filter(id__lt=before_id)
+    
+    # Newest first, plus one row to detect older history
+    window = list(window.select_related(
+        'sender', 'sender__user', 'reply_to', 'reply_to__sender', 'reply_to__sender__user'
+    ).prefetch_related('reactions').order_by('-id')[:page_size + 1])
+    has_older = len(window) > page_size
+    window = window[:page_size]
+    window.reverse()
+    
+    older_messages_url = None
+    if has_older:
+        older_messages_url = f"{reverse('get_older_messages', args=[chat_room.id])}?{urlencode({'before': window[0].id})}"
+    
+    return window, older_messages_url
+
 @login_required
 def send_message(request, room_id):
     """Send a message to a chat room"""
@@ -550,53 +620,103 @@ def send_message(request, room_id):
         message.save()
         
         # Mark all previous messages as read for the sender
-        unread_messages = Message.objects.filter(
-            room=chat_room, 
-            is_read=False
-        ).exclude(sender=request.user.profile)
-        unread_messages.update(is_read=True)
+        mark_room_read(chat_room, request.user.profile)
         
         return JsonResponse({'status': 'success', 'message': 'Message sent successfully', 'message_id': message.id})
     except ChatRoom.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Chat room does not exist'})
 
-@login_required
-def message_stream(request, room_id):
-    """Stream messages using Server-Sent Events (SSE)"""
-    chat_room = get_object_or_404(ChatRoom, id=room_id)
-    user_profile = request.user.profile
-    
-    # Check if user is participant
-    if not chat_room.participants.filter(id=user_profile.id).exists():
+@database_sync_to_async
+def _get_stream_access(request, room_id):
+    """Resolve the session user and check they participate in the room"""
+    if not request.user.is_authenticated:
+        return 'login'
+    if not ChatRoom.objects.filter(id=room_id).exists():
+        return 'missing'
+    if not ChatRoom.objects.filter(id=room_id, participants__user=request.user).exists():
+        return 'forbidden'
+    return 'ok'
+
+@database_sync_to_async
+def _get_missed_messages(room_id, after_id):
+    """One page of the messages stored after the client's Last-Event-ID, oldest first"""
+    messages = Message.objects.filter(room_id=room_id, id__gt=after_id).select_related('sender__user').order_by('id')
+    return [message_stream_payload(message) for message in messages[:settings.CHAT_HISTORY_PAGE_SIZE]]
+
+def _sse_event(messages):
+    data = {'type': 'message', 'messages': messages}
+    return f"id: {messages[-1]['id']}\nevent: message\ndata: {json.dumps(data)}\n\n"
+
+async def message_stream(request, room_id):
+    """
+    Stream messages using Server-Sent Events (SSE).
+    Listens on the room's channel layer group instead of polling the database;
+    idle connections only cost a periodic heartbeat. Clients reconnecting with
+    Last-Event-ID first receive what they missed.
+    Django does not watch for client disconnects: under ASGI (Daphne) the
+    generator is cancelled when the client goes away, but under WSGI it would
+    only notice on a failed write. Every stream therefore ends after
+    CHAT_STREAM_MAX_SECONDS and the browser reconnects where it left off.
+    """
+    access = await _get_stream_access(request, room_id)
+    if access == 'login':
+        return redirect_to_login(request.get_full_path())
+    if access == 'missing':
+        raise Http404("Chat room does not exist")
+    if access == 'forbidden':
         return HttpResponseForbidden("Access denied")
-    
-    def event_stream():
-        last_id = 0
-        while True:
-            # Get new messages
-            messages = Message.objects.filter(
-                room=chat_room,
-                id__gt=last_id
-            ).order_by('timestamp')
-            
-            if messages.exists():
-                last_id = messages.last().id
-                data = {
-                    'type': 'message',
-                    'messages': [
-                        {
-                            'id': msg.id,
-                            'content': msg.content,
-                            'sender': msg.sender.user.username,
-                            'timestamp': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                        }
-                        for msg in messages
-                    ]
-                }
-                yield f"data: {json.dumps(data)}\n\n"
-            
-            time.sleep(1)  # Wait 1 second before checking for new messages
-    
+
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or 0)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid Last-Event-ID")
+
+    channel_layer = get_channel_layer()
+    heartbeat = settings.CHAT_STREAM_HEARTBEAT_SECONDS
+    max_seconds = getattr(settings, 'CHAT_STREAM_MAX_SECONDS', 600)
+
+    async def event_stream():
+        nonlocal last_id
+        group_name = f'chat_{room_id}'
+        channel_name = await channel_layer.new_channel()
+        # Subscribe before reading the backlog so nothing falls in between
+        await channel_layer.group_add(group_name, channel_name)
+        try:
+            yield f"retry: {settings.CHAT_STREAM_RETRY_MS}\n\n"
+
+            # Send the whole backlog page by page before going live, since live
+            # events move last_id past anything still unsent
+            while last_id:
+                missed = await _get_missed_messages(room_id, last_id)
+                if not missed:
+                    break
+                last_id = missed[-1]['id']
+                yield _sse_event(missed)
+                if len(missed) < settings.CHAT_HISTORY_PAGE_SIZE:
+                    break
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + max_seconds
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(channel_layer.receive(channel_name), timeout=min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if event.get('type') != 'message_saved':
+                    continue
+                message = event['message']
+                if message['id'] <= last_id:
+                    continue
+                last_id = message['id']
+                yield _sse_event([message])
+        finally:
+            await channel_layer.group_discard(group_name, channel_name)
+
     response = StreamingHttpResponse(
         event_stream(),
         content_type='text/event-stream'
@@ -605,6 +725,10 @@ def message_stream(request, room_id):
     response['X-Accel-Buffering'] = 'no'
     return response
 
+def _counter_value(model, pk, field_name):
+    """Current value of a denormalized counter, read with a single values() query"""
+    return model.objects.filter(pk=pk).values_list(field_name, flat=True).first() or 0
+
 @login_required
 def add_post_reaction(request, post_id):
     """Add a reaction to a post"""
@@ -613,6 +737,10 @@ def add_post_reaction(request, post_id):
         post = get_object_or_404(Post, id=post_id)
         user_profile = request.user.profile
         
+        # Validate reaction type
+        if reaction_type not in [r[0] for r in REACTION_TYPES]:
+            return JsonResponse({'status': 'error', 'message': 'Invalid reaction type'}, status=400)
+        
         try:
             # Check if user already reacted to this post
             existing_reaction = PostReaction.objects.filter(post=post, user=user_profile).first()
@@ -621,12 +749,12 @@ def add_post_reaction(request, post_id):
                 # If the reaction is the same, remove it (toggle off)
                 if existing_reaction.reaction_type == reaction_type:
                     existing_reaction.delete()
-                    return JsonResponse({'status': 'success', 'action': 'removed', 'count': post.reactions.count()})
+                    action = 'removed'
                 else:
                     # Update to new reaction type
                     existing_reaction.reaction_type = reaction_type
                     existing_reaction.save()
-                    return JsonResponse({'status': 'success', 'action': 'updated', 'type': reaction_type, 'count': post.reactions.count()})
+                    action = 'updated'
             else:
                 # Create new reaction
                 PostReaction.objects.create(
@@ -634,11 +762,17 @@ def add_post_reaction(request, post_id):
                     user=user_profile,
                     reaction_type=reaction_type
                 )
-                return JsonResponse({'status': 'success', 'action': 'added', 'type': reaction_type, 'count': post.reactions.count()})
+                action = 'added'
         except IntegrityError:
             # If there's a race condition (user double-clicked), handle it gracefully
             # Just get the current reaction count and return it
-            return JsonResponse({'status': 'success', 'action': 'exists', 'count': post.reactions.count()})
+            action = 'exists'
+        
+        # Read the counter maintained by the reaction signal handlers
+        response = {'status': 'success', 'action': action, 'count': _counter_value(Post, post.id, 'reaction_count')}
+        if action in ('added', 'updated'):
+            response['type'] = reaction_type
+        return JsonResponse(response)
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
@@ -679,17 +813,10 @@ def add_comment(request, post_id):
         if request.headers.get('HX-Request'):
             print(f"[DEBUG] HTMX request detected, returning full comments list")
             # Get all comments and add reaction info
-            comments = post.comments.filter(parent_comment=None).order_by('-created_at')
-            
-            def add_reaction_info(comment_list):
-                for c in comment_list:
-                    c.user_has_reacted = CommentReaction.objects.filter(
-                        comment=c, user=user_profile
-                    ).exists()
-                    if hasattr(c, 'replies'):
-                        add_reaction_info(c.replies.all())
-            
-            add_reaction_info(comments)
+            comments = post.comments.filter(parent_comment=None).order_by('-created_at').select_related(
+                'author', 'author__user'
+            ).prefetch_related('replies', 'replies__author', 'replies__author__user')
+            comments = attach_comment_reactions(comments, user_profile, include_replies=True)
             
             context = {
                 'post': post,
@@ -701,6 +828,7 @@ def add_comment(request, post_id):
             return render(request, 'chat/comments_list.html', context)
         
         # Otherwise return JSON for API
+        
         # Set user reaction info for template
         comment.user_has_reacted = False
         
@@ -715,7 +843,7 @@ def add_comment(request, post_id):
             'status': 'success', 
             'html': html, 
             'comment_id': comment.id, 
-            'count': post.comments.count(),
+            'count': _counter_value(Post, post.id, 'comment_count'),
             'is_reply': bool(parent_comment_id)
         })
     
@@ -763,8 +891,8 @@ def add_comment_reaction(request, comment_id):
                 )
                 user_has_reacted = True
             
-            # Get updated reaction count
-            reaction_count = comment.reactions.count()
+            # Get updated reaction count from the counter kept by the signal handlers
+            reaction_count = _counter_value(Comment, comment.id, 'reaction_count')
             
             # If this is an HTMX request, return the updated button
             if request.headers.get('HX-Request'):
@@ -903,23 +1031,12 @@ def get_comments(request, post_id):
     else:
         comments = Comment.objects.filter(post=post, parent_comment=None, is_hidden=False)
         
-    comments = comments.select_related('author', 'author__user').prefetch_related('reactions')
-    
-    # Add reaction info to each comment
-    def add_reaction_info(comment_list):
-        """Add reaction information to comments"""
-        for comment in comment_list:
-            comment.user_has_reacted = CommentReaction.objects.filter(
-                comment=comment, 
-                user=request.user.profile
-            ).exists()
-            
-            # Also process all replies to this comment
-            if hasattr(comment, 'replies'):
-                replies = comment.replies.all()
-                add_reaction_info(replies)
+    comments = comments.select_related('author', 'author__user').prefetch_related(
+        'replies', 'replies__author', 'replies__author__user'
+    )
     
-    add_reaction_info(comments)
+    # Add reaction info to each comment and its replies
+    comments = attach_comment_reactions(comments, request.user.profile, include_replies=True)
     
     context = {
         'post': post,
@@ -939,7 +1056,7 @@ def get_comments(request, post_id):
         return JsonResponse({
             'status': 'success', 
             'html': html, 
-            'count': comments.count()
+            'count': len(comments)
         })
 
 @login_required
@@ -1474,30 +1591,102 @@ def decline_voice_call(request, call_id):
 # Moderation Dashboard
 @user_passes_test(is_moderator)
 def moderation_dashboard(request):
-    """Dashboard for content moderation"""
-    pending_items = ContentModerationStatus.objects.filter(status='pending').select_related('content_object')
-    approved_items = ContentModerationStatus.objects.filter(status='approved').select_related('content_object')
-    rejected_items = ContentModerationStatus.objects.filter(status='rejected').select_related('content_object')
-    error_items = ContentModerationStatus.objects.filter(status='error').select_related('content_object')
-    
-    # Add display name for content type
-    for queryset in [pending_items, approved_items, rejected_items, error_items]:
-        for item in queryset:
-            item.content_type_display = dict(ContentModerationStatus.CONTENT_TYPE_CHOICES).get(item.content_type, item.content_type)
+    """
+    Dashboard for content moderation. Only the selected status tab is loaded,
+    one keyset page at a time, optionally filtered by content type.
+    """
+    statuses = dict(ContentModerationStatus.MODERATION_STATUS_CHOICES)
+    content_types = dict(ContentModerationStatus.CONTENT_TYPE_CHOICES)
+    
+    status = request.GET.get('status', 'pending')
+    if status not in statuses:
+        status = 'pending'
+    content_type = request.GET.get('content_type', '')
+    if content_type not in content_types:
+        content_type = ''
+    try:
+        before_id = int(request.GET.get('before', ''))
+    except ValueError:
+        before_id = None
+    
+    items, next_page_url = _get_moderation_page(status, content_type, before_id)
+    
+    # Tab badges come from one grouped COUNT instead of a query per status
+    counts = ContentModerationStatus.objects.all()
+    if content_type:
+        counts = counts.filter(content_type=content_type)
+    counts = dict(counts.order_by().values_list('status').annotate(count=Count('id')))
+    
+    filter_query = {'content_type': content_type} if content_type else {}
+    tabs = [{
+        'status': key,
+        'label': label,
+        'count': counts.get(key, 0),
+        'url': f"{reverse('moderation_dashboard')}?{urlencode({'status': key, **filter_query})}",
+    } for key, label in ContentModerationStatus.MODERATION_STATUS_CHOICES]
     
     context = {
-        'pending_items': pending_items,
-        'pending_count': pending_items.count(),
-        'approved_items': approved_items,
-        'approved_count': approved_items.count(),
-        'rejected_items': rejected_items,
-        'rejected_count': rejected_items.count(),
-        'error_items': error_items,
-        'error_count': error_items.count(),
+        'status': status,
+        'status_label': statuses[status],
+        'content_type': content_type,
+        'content_type_choices': ContentModerationStatus.CONTENT_TYPE_CHOICES,
+        'tabs': tabs,
+        'items': items,
+        'next_page_url': next_page_url,
     }
     
     return render(request, 'chat/moderation_dashboard.html', context)
 
+# content_type -> (model, related rows needed to show the preview and uploader)
+MODERATION_CONTENT_MODELS = {
+    'post_image': (PostImage, ['post__author__user']),
+    'post_video': (PostVideo, ['post__author__user']),
+    'message_image': (Message, ['sender__user']),
+    'message_video': (Message, ['sender__user']),
+    'avatar': (Profile, ['user']),
+    'comment': (Comment, ['author__user']),
+}
+
+def _get_moderation_page(status, content_type='', before_id=None):
+    """
+    Read one page of moderation rows with the given status, newest first,
+    keyset-paginated on the id. Each row gets its moderated object attached
+    as content_object, loaded with one query per content type on the page.
+    Returns a tuple (items, next_page_url)
+    """
+    page_size = getattr(settings, 'MODERATION_DASHBOARD_PAGE_SIZE', 50)
+    
+    page = ContentModerationStatus.objects.filter(status=status)
+    if content_type:
+        page = page.filter(content_type=content_type)
+    if before_id is not None:
+        page = page.filter(id__lt=before_id)
+    
+    # One extra row tells whether another page exists
+    page = list(page.order_by('-id')[:page_size + 1])
+    has_more = len(page) > page_size
+    page = page[:page_size]
+    
+    ids_by_type = {}
+    for item in page:
+        ids_by_type.setdefault(item.content_type, set()).add(item.content_id)
+    objects_by_type = {}
+    for item_type, ids in ids_by_type.items():
+        if item_type in MODERATION_CONTENT_MODELS:
+            model, related = MODERATION_CONTENT_MODELS[item_type]
+            objects_by_type[item_type] = model.objects.select_related(*related).in_bulk(ids)
+    for item in page:
+        item.content_object = objects_by_type.get(item.content_type, {}).get(item.content_id)
+    
+    next_page_url = None
+    if has_more:
+        query = {'status': status, 'before': page[-1].id}
+        if content_type:
+            query['content_type'] = content_type
+        next_page_url = f"{reverse('moderation_dashboard')}?{urlencode(query)}"
+    
+    return page, next_page_url
+
 @user_passes_test(is_moderator)
 def approve_content(request, moderation_id):
     """Approve content that was flagged for moderation"""
@@ -1599,66 +1788,22 @@ def retry_moderation(request, moderation_id):
     if request.method == 'POST':
         try:
             moderation = ContentModerationStatus.objects.get(id=moderation_id)
+            if moderation.content_type not in MODERATED_MEDIA:
+                messages.error(request, f"Only uploaded media can be moderated again.")
+                return redirect('moderation_dashboard')
             
-            # Get the content object based on type
-            content_object = None
-            if moderation.content_type == 'post_image':
-                content_object = PostImage.objects.get(id=moderation.content_id)
-                is_safe, confidence, categories = moderate_image(content_object.image)
-            elif moderation.content_type == 'post_video':
-                content_object = PostVideo.objects.get(id=moderation.content_id)
-                is_safe, confidence, categories = moderate_video(content_object.video)
-            elif moderation.content_type == 'message_image':
-                content_object = Message.objects.get(id=moderation.content_id)
-                is_safe, confidence, categories = moderate_image(content_object.image)
-            elif moderation.content_type == 'message_video':
-                content_object = Message.objects.get(id=moderation.content_id)
-                is_safe, confidence, categories = moderate_video(content_object.video)
+            # Hand the content back to the moderation worker
+            moderation.status = 'pending'
+            moderation.moderation_date = None
+            moderation.rejection_reason = None
+            moderation.save()
+            ModerationJob.objects.create(
+                content_type=moderation.content_type,
+                content_id=moderation.content_id,
+                moderation_status=moderation
+            )
             
-            if content_object:
-                # Update moderation status
-                moderation.status = 'approved' if is_safe else 'rejected'
-                moderation.moderation_date = timezone.now()
-                moderation.rejection_reason = 'Inappropriate content detected' if not is_safe else None
-                moderation.moderation_data = categories
-                moderation.save()
-                
-                # Update the object's moderation status
-                if moderation.content_type == 'post_image':
-                    content_object.is_moderated = True
-                    content_object.moderation_passed = is_safe
-                    content_object.save()
-                    
-                    if not is_safe:
-                        post = content_object.post
-                        post.moderation_passed = False
-                        post.is_moderated = True
-                        post.save()
-                        
-                elif moderation.content_type == 'post_video':
-                    content_object.is_moderated = True
-                    content_object.moderation_passed = is_safe
-                    content_object.save()
-                    
-                    if not is_safe:
-                        post = content_object.post
-                        post.moderation_passed = False
-                        post.is_moderated = True
-                        post.save()
-                        
-                elif moderation.content_type == 'message_image':
-                    content_object.is_image_moderated = True
-                    content_object.image_moderation_passed = is_safe
-                    content_object.save()
-                    
-                elif moderation.content_type == 'message_video':
-                    content_object.is_video_moderated = True
-                    content_object.video_moderation_passed = is_safe
-                    content_object.save()
-                
-                messages.success(request, f"Content moderation retried successfully.")
-            else:
-                messages.error(request, f"Content not found.")
+            messages.success(request, f"Content queued for moderation again.")
                 
         except Exception as e:
             messages.error(request, f"Error retrying moderation: {str(e)}")
@@ -149,11 +149,79 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 ASGI_APPLICATION = "chat_project.asgi.application"
 
 # Channel layers configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# The in-memory layer only reaches sockets in the same process; set REDIS_URL
+# (or CHANNEL_LAYER_BACKEND) to broadcast across Daphne processes and nodes.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'redis' if REDIS_URL else 'memory')
+# Messages buffered per channel before sends start failing
+CHANNEL_LAYER_CAPACITY = int(os.environ.get('CHANNEL_LAYER_CAPACITY', '100'))
+# Seconds an undelivered message is kept
+CHANNEL_LAYER_EXPIRY = int(os.environ.get('CHANNEL_LAYER_EXPIRY', '60'))
+# Seconds a channel stays in a group without being re-added
+CHANNEL_LAYER_GROUP_EXPIRY = int(os.environ.get('CHANNEL_LAYER_GROUP_EXPIRY', '86400'))
+
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL or 'redis://127.0.0.1:6379'],
+                'capacity': CHANNEL_LAYER_CAPACITY,
+                'expiry': CHANNEL_LAYER_EXPIRY,
+                'group_expiry': CHANNEL_LAYER_GROUP_EXPIRY,
+                'prefix': os.environ.get('CHANNEL_LAYER_PREFIX', 'asgi'),
+            },
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == 'redis_pubsub':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL or 'redis://127.0.0.1:6379'],
+                'prefix': os.environ.get('CHANNEL_LAYER_PREFIX', 'asgi'),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {
+                'capacity': CHANNEL_LAYER_CAPACITY,
+                'expiry': CHANNEL_LAYER_EXPIRY,
+                'group_expiry': CHANNEL_LAYER_GROUP_EXPIRY,
+            },
+        },
+    }
+
+# Caches
+# Shared through Redis when REDIS_URL is set, so every process sees the same
+# unread counts and moderation verdicts; otherwise per-process memory (LRU).
+MODERATION_VERDICT_CACHE_SIZE = int(os.environ.get('MODERATION_VERDICT_CACHE_SIZE', '10000'))
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'moderation': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'moderation',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'moderation': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'moderation-verdicts',
+            'OPTIONS': {'MAX_ENTRIES': MODERATION_VERDICT_CACHE_SIZE},
+        },
+    }
 
 # Media files (User uploaded files)
 MEDIA_URL = '/media/'
@@ -164,11 +232,76 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Home feed settings
+# Number of posts read from a user's timeline per feed page
+HOME_FEED_SIZE = int(os.environ.get('HOME_FEED_SIZE', '50'))
+# Number of a new friend's most recent posts copied into the timeline. Older posts
+# never reach the home feed (only the author's profile); 0 copies the whole history
+TIMELINE_BACKFILL_LIMIT = int(os.environ.get('TIMELINE_BACKFILL_LIMIT', '200'))
+# Posts copied per query while backfilling
+TIMELINE_BACKFILL_BATCH = int(os.environ.get('TIMELINE_BACKFILL_BATCH', '500'))
+
+# Chat settings
+# Number of messages loaded when a room opens and per "load older" request
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get('CHAT_HISTORY_PAGE_SIZE', '50'))
+# Seconds between keep-alive comments on an idle message stream
+CHAT_STREAM_HEARTBEAT_SECONDS = int(os.environ.get('CHAT_STREAM_HEARTBEAT_SECONDS', '15'))
+# Milliseconds an SSE client waits before reconnecting
+CHAT_STREAM_RETRY_MS = int(os.environ.get('CHAT_STREAM_RETRY_MS', '3000'))
+# Seconds after which a message stream ends and the client reconnects with
+# Last-Event-ID; bounds streams whose disconnect the server never notices
+CHAT_STREAM_MAX_SECONDS = int(os.environ.get('CHAT_STREAM_MAX_SECONDS', '600'))
+# Write WebSocket chat messages in batches: at most CHAT_WRITE_BUFFER_SIZE messages
+# or CHAT_WRITE_BUFFER_INTERVAL_MS milliseconds after the first one waits
+CHAT_WRITE_BUFFER_ENABLED = os.environ.get('CHAT_WRITE_BUFFER_ENABLED', 'False').lower() == 'true'
+CHAT_WRITE_BUFFER_SIZE = int(os.environ.get('CHAT_WRITE_BUFFER_SIZE', '50'))
+CHAT_WRITE_BUFFER_INTERVAL_MS = int(os.environ.get('CHAT_WRITE_BUFFER_INTERVAL_MS', '20'))
+
+# Startup import budget checked by `manage.py check_import_time`: web workers must
+# import in under STARTUP_IMPORT_BUDGET_MS and never load the moderation backends
+STARTUP_IMPORT_BUDGET_MS = float(os.environ.get('STARTUP_IMPORT_BUDGET_MS', '800'))
+STARTUP_FORBIDDEN_IMPORTS = ['cv2', 'numpy', 'tensorflow', 'nudenet', 'av', 'requests', 'chat.content_moderation']
+
 # Content moderation settings
 CONTENT_MODERATION_SERVICE = os.environ.get('CONTENT_MODERATION_SERVICE', 'nudenet')
-
-# Blood detection threshold (percentage of image that's red)
+# Rows per page on the moderation dashboard
+MODERATION_DASHBOARD_PAGE_SIZE = int(os.environ.get('MODERATION_DASHBOARD_PAGE_SIZE', '50'))
+
+# Moderation worker: inference processes, queue poll interval (s),
+# attempts per job, base retry delay (s) and seconds before a stuck job is reclaimed
+MODERATION_WORKER_PROCESSES = int(os.environ.get('MODERATION_WORKER_PROCESSES', '2'))
+MODERATION_WORKER_POLL_INTERVAL = float(os.environ.get('MODERATION_WORKER_POLL_INTERVAL', '2'))
+MODERATION_JOB_MAX_ATTEMPTS = int(os.environ.get('MODERATION_JOB_MAX_ATTEMPTS', '3'))
+MODERATION_JOB_RETRY_DELAY = int(os.environ.get('MODERATION_JOB_RETRY_DELAY', '60'))
+MODERATION_JOB_TIMEOUT = int(os.environ.get('MODERATION_JOB_TIMEOUT', '600'))
+# Images moderated together in one inference call
+MODERATION_BATCH_SIZE = int(os.environ.get('MODERATION_BATCH_SIZE', '8'))
+# Cache alias and lifetime (s) of moderation verdicts keyed by media hash
+MODERATION_VERDICT_CACHE = os.environ.get('MODERATION_VERDICT_CACHE', 'moderation')
+MODERATION_VERDICT_CACHE_TTL = int(os.environ.get('MODERATION_VERDICT_CACHE_TTL', '86400'))
+# Also match re-encoded copies of rejected media by perceptual hash, not only identical bytes
+MODERATION_VERDICT_CACHE_PERCEPTUAL = os.environ.get('MODERATION_VERDICT_CACHE_PERCEPTUAL', 'True').lower() == 'true'
+# Frames sampled per video (about one per second), and whether to decode keyframes only (needs PyAV)
+MODERATION_VIDEO_MAX_FRAMES = int(os.environ.get('MODERATION_VIDEO_MAX_FRAMES', '10'))
+MODERATION_VIDEO_KEYFRAMES_ONLY = os.environ.get('MODERATION_VIDEO_KEYFRAMES_ONLY', 'False').lower() == 'true'
+# Load the moderation models when a worker process starts instead of on the first image
+MODERATION_WARM_MODELS = os.environ.get('MODERATION_WARM_MODELS', 'True').lower() == 'true'
+
+# Cheap pre-filter stages run before the moderation service, in order ('sanity', 'blood')
+MODERATION_CASCADE = [stage.strip() for stage in os.environ.get('MODERATION_CASCADE', 'sanity,blood').split(',') if stage.strip()]
+# Images whose longer side is below this many pixels are approved without a model
+MODERATION_MIN_IMAGE_SIDE = int(os.environ.get('MODERATION_MIN_IMAGE_SIDE', '32'))
+# Blood score at which the colour pre-filter rejects an image by itself; 0 disables
+# the hard reject and leaves every image to the moderation service
+MODERATION_CASCADE_BLOOD_REJECT_SCORE = float(os.environ.get('MODERATION_CASCADE_BLOOD_REJECT_SCORE', '0'))
+
+# Blood detection threshold: share of blood-red pixels (0-1) at which an image is
+# flagged. It is compared with the red share itself, not the 0-1 blood score
+# (5x the share) as before, so the default 0.1 now flags images that are 10% red
+# instead of 2% red
 BLOOD_DETECTION_THRESHOLD = float(os.environ.get('BLOOD_DETECTION_THRESHOLD', '0.1'))
+# Longest side (pixels) images are reduced to before the blood colour analysis
+BLOOD_DETECTION_MAX_SIDE = int(os.environ.get('BLOOD_DETECTION_MAX_SIDE', '256'))
 
 # Moderation thresholds
 MODERATION_THRESHOLD_NUDITY = float(os.environ.get('MODERATION_THRESHOLD_NUDITY', '0.6'))
@@ -179,6 +312,19 @@ MODERATION_THRESHOLD_GORE = float(os.environ.get('MODERATION_THRESHOLD_GORE', '0
 SIGHTENGINE_API_USER = os.environ.get('SIGHTENGINE_API_USER', '')
 SIGHTENGINE_API_SECRET = os.environ.get('SIGHTENGINE_API_SECRET', '')
 GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', '')
+SIGHTENGINE_API_URL = os.environ.get('SIGHTENGINE_API_URL', 'https://api.sightengine.com/1.0')
+
+# Remote moderation API client: read/connect timeouts (s), retries with backoff (s),
+# concurrent requests and requests per second per process (0 = unlimited), and
+# consecutive failures before the circuit opens for MODERATION_API_CIRCUIT_RESET seconds
+MODERATION_API_TIMEOUT = float(os.environ.get('MODERATION_API_TIMEOUT', '10'))
+MODERATION_API_CONNECT_TIMEOUT = float(os.environ.get('MODERATION_API_CONNECT_TIMEOUT', '3.05'))
+MODERATION_API_MAX_RETRIES = int(os.environ.get('MODERATION_API_MAX_RETRIES', '2'))
+MODERATION_API_BACKOFF = float(os.environ.get('MODERATION_API_BACKOFF', '0.5'))
+MODERATION_API_MAX_CONCURRENCY = int(os.environ.get('MODERATION_API_MAX_CONCURRENCY', '4'))
+MODERATION_API_RATE_LIMIT = float(os.environ.get('MODERATION_API_RATE_LIMIT', '0'))
+MODERATION_API_CIRCUIT_FAILURES = int(os.environ.get('MODERATION_API_CIRCUIT_FAILURES', '5'))
+MODERATION_API_CIRCUIT_RESET = float(os.environ.get('MODERATION_API_CIRCUIT_RESET', '30'))
 
 # Logging configuration for content moderation
 LOGGING = {
@@ -209,6 +355,21 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'chat.moderation_client': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': True,
+        },
+        'chat.moderation_queue': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': True,
+        },
+        'chat.message_buffer': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': True,
+        },
         'chat.models': {
             'handlers': ['console', 'file'],
             'level': 'INFO',
@@ -11,22 +11,11 @@ pip install -r requirements.txt
 # Explicitly install channels and daphne if not already in requirements
 pip install channels channels-redis daphne --no-deps --upgrade
 
-echo "Running migrations in a way that handles existing tables..."
-
-# First apply migrations up to 0002
-python manage.py migrate auth
-python manage.py migrate contenttypes
-python manage.py migrate admin
-python manage.py migrate sessions
-python manage.py migrate chat 0002
-
-# Fake the problematic migration that's trying to create tables that already exist
-echo "Faking migration chat.0003_add_voice_call_model..."
-python manage.py migrate chat 0003 --fake
-
-# Continue with the rest of the migrations
-echo "Continuing with remaining migrations..."
-python manage.py migrate
+# Apply migrations under the same advisory lock as the release step, so a build
+# and a release never migrate the same database at once. 0003 no longer needs
+# faking: it is empty, since 0001_initial already creates VoiceCall.
+echo "Applying migrations..."
+python manage.py migrate_with_lock
 
 # Create a temporary script to fix the database
 cat > fix_db_script.py << 'EOL'
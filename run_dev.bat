@@ -6,5 +6,8 @@ echo Make sure you have installed: pip install daphne channels channels-redis
 set PORT=8000
 echo Using port: %PORT%
 
+:: Apply pending migrations once; the server itself no longer migrates on startup
+python manage.py migrate_with_lock
+
 :: Run Daphne ASGI server
 daphne -b 0.0.0.0 -p %PORT% chat_project.asgi:application 
\ No newline at end of file